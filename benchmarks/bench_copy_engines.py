@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Benchmark of the file_transfer.py 'zerocopy' copy engines against shutil.copy2.
+
+
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import file_transfer
+
+
+ENGINES = ['shutil.copy2', 'reflink', 'copy_file_range', 'sendfile', 'buffered', 'zerocopy']
+
+
+def parse_size(size_str):
+    units = {'KB': 1024, 'MB': 1024**2, 'GB': 1024**3}
+    return int(float(size_str[:-2]) * units[size_str[-2:].upper()])
+
+
+def write_random_file(path, size):
+    with open(path, 'wb') as fp:
+        remaining = size
+        while remaining > 0:
+            nbytes = min(remaining, 64*1024*1024)
+            fp.write(os.urandom(nbytes))
+            remaining -= nbytes
+
+
+def get_copy_function(engine):
+    if engine == 'shutil.copy2':
+        return shutil.copy2
+    copy_method = file_transfer.ZeroCopyMethod()
+    copy_method.set_options(copy_overwrite=True, verbose=False)
+    if engine != 'zerocopy':
+        # Force a single engine (or the buffered fallback if none is enabled)
+        copy_method.reflink_supported = copy_method.reflink_supported and (engine == 'reflink')
+        copy_method.copy_file_range_supported = hasattr(os, 'copy_file_range') and (engine == 'copy_file_range')
+        copy_method.sendfile_supported = copy_method.sendfile_supported and (engine == 'sendfile')
+    return copy_method.exec
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark file copy engines across file sizes.")
+    parser.add_argument('workdir', help="Scratch directory on the filesystem to benchmark.")
+    parser.add_argument('--sizes', nargs='+', default=['1KB', '1MB', '1GB', '8GB'],
+                        help="File sizes to benchmark, with a KB/MB/GB suffix.")
+    parser.add_argument('--min-total', default='2GB',
+                        help="Copy each size repeatedly until at least this many bytes are copied (at least 2 copies).")
+    parser.add_argument('--max-files', type=int, default=2000, help="Maximum number of copies per size.")
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES,
+                        help="Copy engines to benchmark; 'zerocopy' is the method's default engine order.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+    min_total_bytes = parse_size(args.min_total)
+
+    print("{:>6}  {:<16} {:>10} {:>12}".format('size', 'engine', 'MB/s', 'files/s'))
+    for size_str in args.sizes:
+        size = parse_size(size_str)
+        ncopies = min(args.max_files, max(2, min_total_bytes // max(size, 1)))
+        srcfile = os.path.join(args.workdir, 'src_{}'.format(size_str))
+        write_random_file(srcfile, size)
+        for engine in args.engines:
+            copy_fn = get_copy_function(engine)
+            start_time = time.time()
+            for i in range(ncopies):
+                dstfile = os.path.join(args.workdir, 'dst_{}'.format(i % 2))
+                if os.path.exists(dstfile):
+                    os.remove(dstfile)
+                copy_fn(srcfile, dstfile)
+            elapsed = time.time() - start_time
+            assert filecmp.cmp(srcfile, dstfile, shallow=False), "{} copy differs from source".format(engine)
+            print("{:>6}  {:<16} {:>10.1f} {:>12.1f}".format(
+                size_str, engine, size*ncopies / elapsed / 1e6, ncopies / elapsed))
+            sys.stdout.flush()
+        for path in os.listdir(args.workdir):
+            os.remove(os.path.join(args.workdir, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark of the make_links.py name filters: exclusion lookups in a list
+# against a frozenset, and per-name prefix/contains/suffix tests with generator
+# expressions against tuple str.startswith/str.endswith and one compiled regex.
+
+
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import make_links
+
+
+def random_name(rng, length=16):
+    return ''.join(rng.choice(string.ascii_lowercase + string.digits + '_') for _ in range(length))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark make_links.py name filter implementations.")
+    parser.add_argument('--exclude-paths', type=int, default=100000, help="Number of exclusion paths.")
+    parser.add_argument('--lookups', type=int, default=10000, help="Number of exclusion path lookups.")
+    parser.add_argument('--names', type=int, default=200000, help="Number of names tested against the name filters.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    ## Exclusion path lookups
+    exclude_paths = ['/data/{}/{}'.format(random_name(rng, 8), random_name(rng)) for _ in range(args.exclude_paths)]
+    lookup_paths = [rng.choice(exclude_paths) if i % 2 else '/data/' + random_name(rng) for i in range(args.lookups)]
+    exclude_list = list(exclude_paths)
+    exclude_set = frozenset(exclude_paths)
+
+    list_sec = timeit.timeit(lambda: [path in exclude_list for path in lookup_paths], number=1)
+    set_sec = timeit.timeit(lambda: [path in exclude_set for path in lookup_paths], number=1)
+    print("{} lookups against {} exclusion paths:".format(args.lookups, args.exclude_paths))
+    print("  list {:.3f} s, frozenset {:.3f} ms".format(list_sec, set_sec*1000))
+
+    ## Name filters
+    prefixes = ['WV01', 'WV02', 'WV03', 'GE01', 'QB02', 'IK01', 'W1W2']
+    contains = ['_P1BS_', '_M1BS_', '_ortho', '_dem', '_matchtag']
+    suffixes = ['.tif', '.xml', '.ntf', '.txt']
+    names = [
+        rng.choice(prefixes + ['XX99']) + random_name(rng, 6) + rng.choice(contains + ['_none_'])
+        + random_name(rng, 6) + rng.choice(suffixes + ['.jpg'])
+        for _ in range(args.names)
+    ]
+
+    def filter_generators():
+        return [name for name in names
+                if any(name.startswith(p) for p in prefixes)
+                and any(c in name for c in contains)
+                and any(name.endswith(s) for s in suffixes)]
+
+    prefix_tuple = tuple(prefixes)
+    suffix_tuple = tuple(suffixes)
+    contains_regex = make_links.compile_contains_regex(contains)
+
+    def filter_compiled():
+        return [name for name in names
+                if name.startswith(prefix_tuple)
+                and contains_regex.search(name)
+                and name.endswith(suffix_tuple)]
+
+    assert filter_generators() == filter_compiled(), "Filter implementations disagree"
+    generators_sec = min(timeit.repeat(filter_generators, number=1, repeat=3))
+    compiled_sec = min(timeit.repeat(filter_compiled, number=1, repeat=3))
+    print("{} names against {} prefixes, {} contains strings and {} suffixes:".format(
+        args.names, len(prefixes), len(contains), len(suffixes)))
+    print("  generator expressions {:.3f} s, compiled filters {:.3f} s ({:.1f}x)".format(
+        generators_sec, compiled_sec, generators_sec / compiled_sec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Benchmark of the file_transfer.py --srclist-check-bydir source existence check
+# against one os.path.exists call per source path.
+
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import file_transfer
+
+
+def build_tree(rootdir, ndirs, nfiles):
+    paths = []
+    for d in range(ndirs):
+        dirpath = os.path.join(rootdir, 'd{:04d}'.format(d))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        for f in range(nfiles):
+            path = os.path.join(dirpath, 'f{:04d}.tif'.format(f))
+            if not os.path.isfile(path):
+                open(path, 'w').close()
+            paths.append(path)
+    return paths
+
+
+def drop_caches():
+    # Requires root; silently ignored otherwise
+    subprocess.call("sync; echo 3 > /proc/sys/vm/drop_caches", shell=True, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark source path existence checks by directory listing.")
+    parser.add_argument('rootdir', help="Scratch directory in which the synthetic source tree is built (reused if present).")
+    parser.add_argument('--ndirs', type=int, default=1000, help="Number of source directories.")
+    parser.add_argument('--nfiles', type=int, default=1000, help="Number of files per source directory.")
+    parser.add_argument('--nmissing', type=int, default=1, help="Number of listed source paths that do not exist.")
+    parser.add_argument('--drop-caches', action='store_true', help="Drop the page/dentry caches before each check (needs root).")
+    args = parser.parse_args()
+
+    paths = build_tree(args.rootdir, args.ndirs, args.nfiles)
+    for i in range(args.nmissing):
+        paths[i*len(paths)//args.nmissing] += '.missing'
+
+    if args.drop_caches:
+        drop_caches()
+    start_time = time.time()
+    missing_exists = [path for path in paths if not os.path.exists(path)]
+    exists_sec = time.time() - start_time
+
+    if args.drop_caches:
+        drop_caches()
+    start_time = time.time()
+    missing_bydir = file_transfer.find_missing_paths_bydir(iter(paths))
+    bydir_sec = time.time() - start_time
+
+    assert missing_bydir == missing_exists, "Check by directory found different missing paths"
+
+    counts = file_transfer.SRCLIST_CHECK_BYDIR_COUNTS
+    print("{} source paths ({} dirs x {} files), {} missing".format(
+        len(paths), args.ndirs, args.nfiles, len(missing_exists)))
+    print("  per-path os.path.exists: {} stat calls, {:.2f} s".format(len(paths), exists_sec))
+    print("  by directory:            {} scandir calls + {} stat calls, {:.2f} s".format(
+        counts['listings'], counts['stats'], bydir_sec))
+
+
+if __name__ == '__main__':
+    main()
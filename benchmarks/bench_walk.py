@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Benchmark of walk.py tree walks (walk, walk_entries, and the os.listdir fallback)
+# against os.walk, on a synthetic tree of directories of empty files.
+
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import walk
+
+
+def build_tree(rootdir, ndirs, nfiles):
+    for d in range(ndirs):
+        dirpath = os.path.join(rootdir, 'd{:04d}'.format(d))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        for f in range(nfiles):
+            path = os.path.join(dirpath, 'f{:04d}.tif'.format(f))
+            if not os.path.isfile(path):
+                open(path, 'w').close()
+
+
+def build_deep_tree(rootdir, depth):
+    # One level at a time, since os.makedirs is itself recursive
+    dirpath = rootdir
+    for _ in range(depth + 1):
+        if not os.path.isdir(dirpath):
+            os.mkdir(dirpath)
+        dirpath = os.path.join(dirpath, 'd')
+
+
+def count_os_walk(rootdir):
+    return sum(1 + len(fnames) for _, _, fnames in os.walk(rootdir))
+
+
+def count_walk(rootdir, list_function=walk.WALK_LIST_FUNCTION_DEFAULT):
+    return sum(1 + len(fnames) for _, _, fnames in walk.walk(rootdir, list_function=list_function))
+
+
+def count_walk_entries(rootdir):
+    return sum(1 + len(file_entries) for _, _, file_entries in walk.walk_entries(rootdir))
+
+
+def size_sum_walk_stat(rootdir):
+    return sum(os.stat(os.path.join(dirpath, fname)).st_size
+               for dirpath, _, fnames in walk.walk(rootdir) for fname in fnames)
+
+
+def size_sum_walk_entries(rootdir):
+    return sum(file_entry.stat().st_size
+               for _, _, file_entries in walk.walk_entries(rootdir) for file_entry in file_entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark walk.py tree walks against os.walk.")
+    parser.add_argument('rootdir', help="Scratch directory in which the synthetic tree is built (reused if present).")
+    parser.add_argument('--ndirs', type=int, default=1000, help="Number of directories.")
+    parser.add_argument('--nfiles', type=int, default=1000, help="Number of files per directory.")
+    parser.add_argument('--deep', type=int, default=1200,
+                        help="Depth of a separate single-branch tree walked once to check that walk depth "
+                             "is not limited by recursion (0 to skip).")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs of each walk (best is reported).")
+    args = parser.parse_args()
+
+    treedir = os.path.join(args.rootdir, 'tree')
+    build_tree(treedir, args.ndirs, args.nfiles)
+
+    walks = [
+        ("os.walk", count_os_walk),
+        ("walk.walk", count_walk),
+        ("walk.walk_entries", count_walk_entries),
+        ("walk.walk, os.listdir fallback", lambda rootdir: count_walk(rootdir, os.listdir)),
+        ("size sum, walk.walk + os.stat(join)", size_sum_walk_stat),
+        ("size sum, walk.walk_entries + entry.stat()", size_sum_walk_entries),
+    ]
+
+    nentries = count_os_walk(treedir)
+    print("{} entries ({} dirs x {} files), best of {}:".format(nentries, args.ndirs, args.nfiles, args.repeat))
+    for descr, walk_fn in walks:
+        sec = min(timeit.repeat(lambda: walk_fn(treedir), number=1, repeat=args.repeat))
+        print("  {:<44} {:.2f} s".format(descr, sec))
+
+    if args.deep > 0:
+        deepdir = os.path.join(args.rootdir, 'deep')
+        build_deep_tree(deepdir, args.deep)
+        ndirs = sum(1 for _ in walk.walk(deepdir))
+        print("{}-level deep tree: walk.walk listed {} directories".format(args.deep, ndirs))
+
+
+if __name__ == '__main__':
+    main()
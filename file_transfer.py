@@ -12,11 +12,32 @@ if su.PYTHON_VERSION < su.VersionString(PYTHON_VERSION_ACCEPTED_MIN):
 
 
 import argparse
+import collections
 import copy
-import glob
+import errno
+import fnmatch
+import hashlib
+import heapq
+import json
+import math
+import multiprocessing
 import os
+import re
+import shutil
+import stat
 import sys
+import threading
+import time
 import traceback
+import walk
+from mkdir_cache import DirectoryCache
+from prefetch import iter_prefetched
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
 
 
 ##############################
@@ -51,6 +72,9 @@ ARGSTR_COPY_METHOD = '--copy-method'
 ARGBRV_COPY_METHOD = '-cm'
 ARGSTR_OVERWRITE = '--overwrite'
 ARGBRV_OVERWRITE = '-o'
+ARGSTR_UPDATE = '--update'
+ARGBRV_UPDATE = '-u'
+ARGSTR_UPDATE_HASH = '--update-hash'
 ARGSTR_MINDEPTH = '--mindepth'
 ARGBRV_MINDEPTH = '-d0'
 ARGSTR_MAXDEPTH = '--maxdepth'
@@ -63,6 +87,18 @@ ARGSTR_COLLAPSE_TREE = '--collapse-tree'
 ARGBRV_COLLAPSE_TREE = '-ct'
 ARGSTR_SRCLIST_DELIM = '--srclist-delim'
 ARGSTR_SRCLIST_NOGLOB = '--srclist-noglob'
+ARGSTR_SRCLIST_NOCHECK = '--srclist-nocheck'
+ARGSTR_SRCLIST_CHECK_BYDIR = '--srclist-check-bydir'
+ARGSTR_JOURNAL = '--journal'
+ARGBRV_JOURNAL = '-j'
+ARGSTR_LARGE_FILE_THRESHOLD = '--large-file-threshold'
+ARGSTR_LARGE_FILE_WORKERS = '--large-file-workers'
+ARGSTR_BUNDLE_BY_SIZE = '--bundle-by-size'
+ARGSTR_BUNDLE_THROUGHPUT = '--bundle-throughput'
+ARGSTR_PROGRESS = '--progress'
+ARGSTR_METRICS_FILE = '--metrics-file'
+ARGSTR_WORKERS = '--workers'
+ARGBRV_WORKERS = '-w'
 ARGSTR_SILENT = '--silent'
 ARGBRV_SILENT = '-s'
 ARGSTR_DEBUG = '--debug'
@@ -75,13 +111,16 @@ ARGCHO_COPY_METHOD_COPY = 'copy'
 ARGCHO_COPY_METHOD_MOVE = 'move'
 ARGCHO_COPY_METHOD_LINK = 'link'
 ARGCHO_COPY_METHOD_SYMLINK = 'symlink'
+ARGCHO_COPY_METHOD_ZEROCOPY = 'zerocopy'
 ARGCHO_COPY_METHOD = [
     ARGCHO_COPY_METHOD_COPY,
     ARGCHO_COPY_METHOD_MOVE,
     ARGCHO_COPY_METHOD_LINK,
-    ARGCHO_COPY_METHOD_SYMLINK
+    ARGCHO_COPY_METHOD_SYMLINK,
+    ARGCHO_COPY_METHOD_ZEROCOPY
 ]
 # Argument choice object mapping (dict of "ARGCHO_" argument options)
+# (the 'zerocopy' copy method object is added below its class definition)
 COPY_METHOD_FUNCTION_DICT = {
     ARGCHO_COPY_METHOD_COPY: su.COPY_METHOD_COPY_DEFAULT,
     ARGCHO_COPY_METHOD_MOVE: su.COPY_METHOD_MOVE,
@@ -97,6 +136,10 @@ ARGMOD_SYNC_MODE_SYNC_TREE = 1
 ARGMOD_SYNC_MODE_TRANSPLANT_TREE = 2
 
 ## Segregation of argument choices (lists of related argument choices)
+ARGCHO_COPY_METHOD_DATA_COPY = [
+    ARGCHO_COPY_METHOD_COPY,
+    ARGCHO_COPY_METHOD_ZEROCOPY
+]
 
 ## Argument choice settings
 
@@ -114,9 +157,12 @@ ARGDEF_MINDEPTH = 0
 ARGDEF_MAXDEPTH = su.ARGNUM_POS_INF
 ARGDEF_BUNDLEDIR = os.path.join(os.path.expanduser('~'), 'scratch', 'task_bundles')
 ARGDEF_SRCLIST_DELIM = ','
+ARGDEF_WORKERS = 1
+ARGDEF_LARGE_FILE_WORKERS = 8
 ARGDEF_JOB_ABBREV = 'Copy'
 ARGDEF_JOB_WALLTIME_HR = 1
 ARGDEF_JOB_MEMORY_GB = 5
+ARGDEF_BUNDLE_THROUGHPUT_MBPS = 100
 
 ## Argument help info ("ARGHLP_", only when needed outside of argparse)
 ARGHLP_SRCLIST_FORMAT = None  # set globally in pre_argparse()
@@ -132,6 +178,10 @@ BUNDLE_TASK_ARGSTRS = [ARGSTR_SRC, ARGSTR_DST]
 BUNDLE_LIST_ARGSTR = ARGSTR_SRCLIST
 BUNDLE_LIST_DESCR = 'srclist'
 
+# Transfer cost model used to balance task bundles by size
+BUNDLE_FILE_OVERHEAD_SEC = 0.01
+BUNDLE_WALLTIME_FILL_FRACTION = 0.8
+
 ##############################
 
 ### Custom globals ###
@@ -146,6 +196,78 @@ PATH_TYPE_FILE = 1
 PATH_TYPE_DIR = 2
 PATH_TYPE_DNE = 3
 
+TASK_STATUS_SUCCESS = 'success'
+TASK_STATUS_SKIPPED = 'skipped'
+TASK_STATUS_FAILED = 'failed'
+TASK_STATUS_LIST = [
+    TASK_STATUS_SUCCESS,
+    TASK_STATUS_SKIPPED,
+    TASK_STATUS_FAILED
+]
+
+# Number of tasks allowed in flight per worker when running in parallel
+WORKER_INFLIGHT_TASKS_PER_WORKER = 4
+
+# Number of built tasks allowed to wait ahead of task execution
+TASK_PREFETCH_QUEUE_SIZE = 1000
+
+# Maximum number of paths held in the path stat cache (least recently used are evicted)
+PATH_STAT_CACHE_MAX_ENTRIES = 200000
+
+# Maximum number of directory listings held by the glob index (least recently used are evicted)
+GLOB_INDEX_MAX_LISTINGS = 1024
+GLOB_MAGIC_CHECK = re.compile('[*?[]')
+
+# Number of source list paths grouped by parent directory at a time for existence checks
+SRCLIST_CHECK_BYDIR_CHUNK_SIZE = 100000
+SRCLIST_CHECK_BYDIR_COUNTS = {'paths': 0, 'listings': 0, 'stats': 0}
+
+# Number of bytes read from both the start and end of files for partial-content hashing
+PARTIAL_HASH_CHUNK_BYTES = 1024*1024
+
+# Buffer size for userspace file copy, and maximum bytes per kernel copy call
+COPY_BUFFER_BYTES = 8*1024*1024
+KERNEL_COPY_CHUNK_BYTES = 1024*1024*1024
+
+# Whether the 'zerocopy' method tries os.copy_file_range after a reflink clone.
+# Off by default: on local filesystems it benchmarked slower than sendfile for
+# large files (see benchmarks/bench_copy_engines.py). It may still pay off where
+# the filesystem performs a server-side copy (e.g. NFS 4.2).
+ZEROCOPY_USE_COPY_FILE_RANGE = False
+
+# Size of byte ranges copied concurrently in large-file mode
+LARGE_FILE_CHUNK_BYTES = 256*1024*1024
+
+# Linux ioctl request to clone (reflink) a whole file, from <linux/fs.h>
+FICLONE = 0x40049409
+
+# Transfer journal record format and sync settings
+JOURNAL_DELIM = '\t'
+JOURNAL_FSYNC_INTERVAL_RECORDS = 1000
+JOURNAL_FSYNC_INTERVAL_SEC = 10
+
+# Per-worker transfer objects, set by init_task_worker() in each worker process
+WORKER_TASK_OPTIONS = None
+WORKER_COPY_METHOD_OBJ = None
+WORKER_WALK_OBJECT = None
+WORKER_METRICS = None
+WORKER_METRICS_DRAIN = False
+WORKER_IN_SUBPROCESS = False
+
+# Transfer metrics operation names
+METRICS_OP_STAT = 'stat'
+METRICS_OP_MKDIR = 'mkdir'
+METRICS_OP_COPY = 'copy'
+METRICS_OP_LINK = 'link'
+METRICS_OP_MOVE = 'move'
+COPY_METHOD_METRICS_OP_DICT = {
+    ARGCHO_COPY_METHOD_COPY: METRICS_OP_COPY,
+    ARGCHO_COPY_METHOD_ZEROCOPY: METRICS_OP_COPY,
+    ARGCHO_COPY_METHOD_MOVE: METRICS_OP_MOVE,
+    ARGCHO_COPY_METHOD_LINK: METRICS_OP_LINK,
+    ARGCHO_COPY_METHOD_SYMLINK: METRICS_OP_LINK
+}
+
 ##############################
 
 
@@ -153,6 +275,10 @@ class MetaReadError(Exception):
     def __init__(self, msg=""):
         super(Exception, self).__init__(msg)
 
+class TaskFailureError(Exception):
+    def __init__(self, msg=""):
+        super(Exception, self).__init__(msg)
+
 
 def pre_argparse():
     global ARGHLP_SRCLIST_FORMAT, ARGHLP_SRCLIST_ROOTED_FORMAT
@@ -266,6 +392,11 @@ def argparser_init():
         default=ARGCHO_COPY_METHOD_LINK,
         help=' '.join([
             "Which copy method to use when performing all file transfers.",
+            "\nThe '{}' method copies file data within the kernel (reflink clone where the".format(ARGCHO_COPY_METHOD_ZEROCOPY),
+            "filesystem supports it, otherwise sendfile), falling back to a",
+            "large-buffer userspace copy, and preserves file permissions and timestamps.",
+            "It is mainly of benefit on filesystems that support reflink clones; elsewhere it",
+            "has not been measured to be faster than the '{}' method.".format(ARGCHO_COPY_METHOD_COPY),
         ])
     )
     parser.add_argument(
@@ -274,6 +405,25 @@ def argparser_init():
         help="[write me]"
     )
 
+    parser.add_argument(
+        ARGBRV_UPDATE, ARGSTR_UPDATE,
+        action='store_true',
+        help=' '.join([
+            "(Only applies to the {} copy methods.)".format(ARGCHO_COPY_METHOD_DATA_COPY),
+            "Copy a source file only if the destination file does not exist, differs in size,",
+            "or has an older modification time than the source file. Existing destination",
+            "files that are out of date are overwritten, regardless of the {} option.".format(ARGSTR_OVERWRITE),
+        ])
+    )
+    parser.add_argument(
+        ARGSTR_UPDATE_HASH,
+        action='store_true',
+        help=' '.join([
+            "When using the {} option, also compare a hash of the first and last {} MiB".format(ARGSTR_UPDATE, PARTIAL_HASH_CHUNK_BYTES//(1024*1024)),
+            "of source and destination files that appear unchanged by size and modification time.",
+        ])
+    )
+
     parser.add_argument(
         ARGBRV_MINDEPTH, ARGSTR_MINDEPTH,
         type=su.ARGTYPE_NUM(argstr=ARGSTR_MINDEPTH,
@@ -333,6 +483,128 @@ def argparser_init():
         ])
     )
 
+    parser.add_argument(
+        ARGBRV_JOURNAL, ARGSTR_JOURNAL,
+        type=su.ARGTYPE_PATH(argstr=ARGSTR_JOURNAL,
+            existcheck_fn=os.path.isdir,
+            existcheck_reqval=False,
+            accesscheck_reqtrue=os.W_OK,
+            accesscheck_parent_if_dne=True),
+        help=' '.join([
+            "Path to append-only journal file of completed transfer tasks.",
+            "\nIf the journal file already exists (from a previous run that did not finish),",
+            "tasks recorded in it are skipped as long as the source path size and modification",
+            "time have not changed since the task was completed.",
+            "\nOnly single-file tasks are recorded; tasks that copy a directory are always rerun.",
+        ])
+    )
+
+    parser.add_argument(
+        ARGSTR_LARGE_FILE_THRESHOLD,
+        type=su.ARGTYPE_NUM(argstr=ARGSTR_LARGE_FILE_THRESHOLD,
+            numeric_type=float, allow_neg=False, allow_zero=False, allow_inf=False),
+        default=None,
+        help=' '.join([
+            "(Only applies to the '{}' copy method.)".format(ARGCHO_COPY_METHOD_ZEROCOPY),
+            "Size in GB at or above which a single file is copied in {} MiB byte ranges".format(LARGE_FILE_CHUNK_BYTES//(1024*1024)),
+            "by {} concurrent threads, into a temporary file that is renamed".format(ARGSTR_LARGE_FILE_WORKERS),
+            "to the destination path once the copy is complete and its length is verified.",
+        ])
+    )
+    parser.add_argument(
+        ARGSTR_LARGE_FILE_WORKERS,
+        type=su.ARGTYPE_NUM(argstr=ARGSTR_LARGE_FILE_WORKERS,
+            numeric_type=int, allow_neg=False, allow_zero=False, allow_inf=False),
+        default=ARGDEF_LARGE_FILE_WORKERS,
+        help=' '.join([
+            "Number of threads used to copy each file at or above {} in size.".format(ARGSTR_LARGE_FILE_THRESHOLD),
+        ])
+    )
+
+    parser.add_argument(
+        ARGSTR_PROGRESS,
+        type=su.ARGTYPE_NUM(argstr=ARGSTR_PROGRESS,
+            numeric_type=float, allow_neg=False, allow_zero=False, allow_inf=False),
+        default=None,
+        help=' '.join([
+            "Print a one-line progress report of files/s, bytes/s, and operation latencies",
+            "at this interval in seconds while tasks are performed.",
+        ])
+    )
+    parser.add_argument(
+        ARGSTR_METRICS_FILE,
+        type=su.ARGTYPE_PATH(argstr=ARGSTR_METRICS_FILE,
+            existcheck_fn=os.path.isdir,
+            existcheck_reqval=False,
+            accesscheck_reqtrue=os.W_OK,
+            accesscheck_parent_if_dne=True),
+        default=None,
+        help=' '.join([
+            "Path to JSON-lines file to which transfer metrics (file and byte counts and rates,",
+            "and per-operation latency histograms for stat, mkdir, copy, link, and move",
+            "operations) are appended at each {} interval and when all tasks are done.".format(ARGSTR_PROGRESS),
+        ])
+    )
+
+    parser.add_argument(
+        ARGBRV_WORKERS, ARGSTR_WORKERS,
+        type=su.ARGTYPE_NUM(argstr=ARGSTR_WORKERS,
+            numeric_type=int, allow_neg=False, allow_zero=False, allow_inf=False),
+        default=ARGDEF_WORKERS,
+        help=' '.join([
+            "Number of workers used to perform transfer tasks in parallel.",
+            "\nA thread pool is used for the '{}', '{}', and '{}' copy methods,".format(
+                ARGCHO_COPY_METHOD_LINK, ARGCHO_COPY_METHOD_SYMLINK, ARGCHO_COPY_METHOD_MOVE),
+            "and a process pool is used for the '{}' copy method.".format(ARGCHO_COPY_METHOD_COPY),
+            "\nWhen more than one worker is used, one line is printed per task in task list order",
+            "(instead of per file) followed by a summary of task results.",
+        ])
+    )
+
+    parser.add_argument(
+        ARGSTR_SRCLIST_NOCHECK,
+        action='store_true',
+        help=' '.join([
+            "Do not check that all source paths in {} and {} textfiles exist before performing tasks.".format(ARGSTR_SRCLIST, ARGSTR_SRCLIST_ROOTED),
+            "Tasks are streamed from the textfiles and start once destination paths have been",
+            "checked, and source paths that do not exist are skipped with a warning when they are reached.",
+        ])
+    )
+
+    parser.add_argument(
+        ARGSTR_SRCLIST_CHECK_BYDIR,
+        action='store_true',
+        help=' '.join([
+            "When checking that all source paths in {} and {} textfiles exist,".format(ARGSTR_SRCLIST, ARGSTR_SRCLIST_ROOTED),
+            "group source paths by parent directory and list each parent directory once",
+            "instead of checking each source path individually.",
+            "\nThis greatly reduces the number of filesystem metadata requests when many",
+            "source paths share the same parent directory.",
+        ])
+    )
+
+    parser.add_argument(
+        ARGSTR_BUNDLE_BY_SIZE,
+        action='store_true',
+        help=' '.join([
+            "When submitting tasks to a scheduler, estimate the transfer cost of each task",
+            "from the size and number of source files, then bundle tasks so that every job",
+            "has about the same estimated cost and fits within the job walltime.",
+            "\nBundles may hold different numbers of tasks, and each is submitted as its own job.",
+            "A tasks-per-job setting is kept as the maximum number of tasks in a bundle.",
+        ])
+    )
+    parser.add_argument(
+        ARGSTR_BUNDLE_THROUGHPUT,
+        type=su.ARGTYPE_NUM(argstr=ARGSTR_BUNDLE_THROUGHPUT,
+            numeric_type=float, allow_neg=False, allow_zero=False, allow_inf=False),
+        default=ARGDEF_BUNDLE_THROUGHPUT_MBPS,
+        help=' '.join([
+            "Expected transfer throughput of a single job in MB/s, used with {}".format(ARGSTR_BUNDLE_BY_SIZE),
+            "to estimate how many bytes each job can transfer within the job walltime.",
+        ])
+    )
+
     su.add_scheduler_arguments(parser,
         ARGDEF_JOB_ABBREV,
         ARGDEF_JOB_WALLTIME_HR,
@@ -390,6 +662,15 @@ def main():
 
     su.check_mut_excl_arggrp(args, ARGCOL_MUT_EXCL)
 
+    if args.get(ARGSTR_UPDATE) and args.get(ARGSTR_COPY_METHOD) not in ARGCHO_COPY_METHOD_DATA_COPY:
+        arg_parser.error("{} option can only be used with {} {}".format(
+            ARGSTR_UPDATE, ARGSTR_COPY_METHOD, ARGCHO_COPY_METHOD_DATA_COPY))
+    if args.get(ARGSTR_LARGE_FILE_THRESHOLD) is not None and args.get(ARGSTR_COPY_METHOD) != ARGCHO_COPY_METHOD_ZEROCOPY:
+        arg_parser.error("{} option can only be used with {} '{}'".format(
+            ARGSTR_LARGE_FILE_THRESHOLD, ARGSTR_COPY_METHOD, ARGCHO_COPY_METHOD_ZEROCOPY))
+    if args.get(ARGSTR_UPDATE_HASH) and not args.get(ARGSTR_UPDATE):
+        arg_parser.error("{} option can only be used with {} option".format(ARGSTR_UPDATE_HASH, ARGSTR_UPDATE))
+
     arg_dst = args.get(ARGSTR_DST) if args.get(ARGSTR_DST) is not None else args.get(ARGSTR_DSTDIR_GLOBAL)
 
     if args.get(ARGSTR_SYNC_TREE):
@@ -414,127 +695,975 @@ def main():
     if args.get(ARGSTR_SRCLIST):
         for srclist_file in args.get(ARGSTR_SRCLIST):
             try:
-                if arg_dst is None:
-                    srclist_header = su.read_task_bundle(
-                        srclist_file, ncol_min=1, ncol_max=2,
-                        header_rows=1, read_header=True,
-                        args_delim=args.get(ARGSTR_SRCLIST_DELIM)
-                    )
-                    if len(srclist_header) == 0:
-                        continue
-                    elif len(srclist_header) != 2:
-                        raise su.DimensionError
-                tasklist = su.Tasklist(
-                    srclist_file, ncol_min=1, ncol_max=2, ncol_strict=True, ncol_strict_header_separate=True,
-                    header_rows=1,
-                    args_delim=args.get(ARGSTR_SRCLIST_DELIM)
+                tasklist = SrclistStream(
+                    srclist_file, args_delim=args.get(ARGSTR_SRCLIST_DELIM), rooted=False
                 )
-                if len(tasklist.header) == 0:
-                    tasklist.header = None
-                elif len(tasklist.tasks) == 0:
-                    tasklist.tasks = [tasklist.header]
-                    tasklist.header = None
-                elif len(tasklist.tasks) > 0:
-                    if len(tasklist.header) == 1:
-                        if type(tasklist.tasks[0]) is list and len(tasklist.tasks[0]) == 2:
-                            raise su.DimensionError
-                        tasklist.tasks.insert(0, tasklist.header[0])
-                        tasklist.header = None
-                    elif len(tasklist.header) == 2:
-                        if type(tasklist.tasks[0]) is list and len(tasklist.tasks[0]) == 2:
-                            tasklist.tasks.insert(0, tasklist.header)
-                            tasklist.header = None
-                        elif type(tasklist.tasks[0]) is list and len(tasklist.tasks[0]) == 1:
-                            tasklist.tasks.insert(0, [tasklist.header[0]])
-                        else:
-                            tasklist.tasks.insert(0, tasklist.header[0])
-                if type(tasklist.header) is list and len(tasklist.header) == 0:
-                    tasklist.header = None
+                if tasklist.empty:
+                    continue
+                if arg_dst is None and tasklist.header is None and tasklist.ncol != 2:
+                    raise su.DimensionError
             except su.DimensionError as e:
                 traceback.print_exc()
                 arg_parser.error("{} textfiles can be structured in one of the following "
                                  "formats:\n".format(ARGSTR_SRCLIST) + ARGHLP_SRCLIST_FORMAT)
 
-            tasklist_src_dne = []
-            for task in tasklist.tasks:
-                task_src = task if type(task) is not list else task[0]
-                if not os.path.exists(task_src):
-                    tasklist_src_dne.append(task_src)
-            if len(tasklist_src_dne) > 0:
-                arg_parser.error("{} {} source paths do not exist:\n{}".format(
-                    ARGSTR_SRCLIST, srclist_file, '\n'.join(tasklist_src_dne)
-                ))
+            if not args.get(ARGSTR_SRCLIST_NOCHECK):
+                tasklist_src_dne = find_missing_srclist_sources(
+                    tasklist, arg_parser, ARGSTR_SRCLIST, args.get(ARGSTR_SRCLIST_CHECK_BYDIR)
+                )
+                if len(tasklist_src_dne) > 0:
+                    arg_parser.error("{} {} source paths do not exist:\n{}".format(
+                        ARGSTR_SRCLIST, srclist_file, '\n'.join(tasklist_src_dne)
+                    ))
 
-            if len(tasklist.tasks) > 0:
-                srclist_tasklists.append(tasklist)
+            srclist_tasklists.append(tasklist)
 
     if args.get(ARGSTR_SRCLIST_ROOTED):
         for srclist_file in args.get(ARGSTR_SRCLIST_ROOTED):
             try:
-                if arg_dst is None:
-                    srclist_first_two_lines = su.read_task_bundle(
-                        srclist_file, ncol_min=1, ncol_max=2,
-                        header_rows=2, read_header=True, allow_1d_task_list=False,
-                        args_delim=args.get(ARGSTR_SRCLIST_DELIM)
-                    )
-                    if len(srclist_first_two_lines) == 0:
-                        pass
-                    elif 2 not in [len(line_items) for line_items in srclist_first_two_lines]:
-                        raise su.DimensionError
-                    else:
-                        srclist_header = srclist_first_two_lines[0]
-                        src_rootdir = srclist_header[0]
-                        dst_rootdir = srclist_header[1] if len(srclist_header) == 2 else None
-                        if not os.path.isdir(src_rootdir):
-                            arg_parser.error(
-                                "{} {} source root directory in header must be an existing directory: {}".format(
-                                ARGSTR_SRCLIST_ROOTED, srclist_file, src_rootdir
-                            ))
-                        if dst_rootdir is not None and os.path.isfile(dst_rootdir):
-                            arg_parser.error(
-                                "{} {} destination root directory in header cannot be an existing file: {}".format(
-                                ARGSTR_SRCLIST_ROOTED, srclist_file, dst_rootdir
-                            ))
-                tasklist = su.Tasklist(
-                    srclist_file, ncol_min=1, ncol_max=2, ncol_strict=True, ncol_strict_header_separate=True,
-                    header_rows=1,
-                    args_delim=args.get(ARGSTR_SRCLIST_DELIM)
+                tasklist = SrclistStream(
+                    srclist_file, args_delim=args.get(ARGSTR_SRCLIST_DELIM), rooted=True
                 )
+                if tasklist.empty or tasklist.ncol is None:
+                    continue
+                if arg_dst is None and 2 not in (len(tasklist.header), tasklist.ncol):
+                    raise su.DimensionError
             except su.DimensionError as e:
                 traceback.print_exc()
                 arg_parser.error("{} textfiles must be structured as follows:\n".format(ARGSTR_SRCLIST_ROOTED)
                                  + ARGHLP_SRCLIST_ROOTED_FORMAT)
 
-            tasklist_src_dne = []
-            for task in tasklist.tasks:
-                task_src = task if type(task) is not list else task[0]
-                if not os.path.exists(task_src):
-                    tasklist_src_dne.append(task_src)
-            if len(tasklist_src_dne) > 0:
-                arg_parser.error("{} {} source paths do not exist:\n{}".format(
-                    ARGSTR_SRCLIST_ROOTED, srclist_file, '\n'.join(tasklist_src_dne)
+            src_rootdir = tasklist.header[0]
+            dst_rootdir = tasklist.header[1] if len(tasklist.header) == 2 else None
+            if not PATH_STAT_CACHE.isdir(src_rootdir):
+                arg_parser.error(
+                    "{} {} source root directory in header must be an existing directory: {}".format(
+                    ARGSTR_SRCLIST_ROOTED, srclist_file, src_rootdir
                 ))
+            if dst_rootdir is not None and PATH_STAT_CACHE.isfile(dst_rootdir):
+                arg_parser.error(
+                    "{} {} destination root directory in header cannot be an existing file: {}".format(
+                    ARGSTR_SRCLIST_ROOTED, srclist_file, dst_rootdir
+                ))
+
+            if not args.get(ARGSTR_SRCLIST_NOCHECK):
+                tasklist_src_dne = find_missing_srclist_sources(
+                    tasklist, arg_parser, ARGSTR_SRCLIST_ROOTED, args.get(ARGSTR_SRCLIST_CHECK_BYDIR)
+                )
+                if len(tasklist_src_dne) > 0:
+                    arg_parser.error("{} {} source paths do not exist:\n{}".format(
+                        ARGSTR_SRCLIST_ROOTED, srclist_file, '\n'.join(tasklist_src_dne)
+                    ))
 
-            if len(tasklist.tasks) > 0:
-                srclist_rooted_tasklists.append(tasklist)
+            srclist_rooted_tasklists.append(tasklist)
 
 
     arg_dst_can_be_file = False
-    if args.get(ARGSTR_SRC) and args.get(ARGSTR_DST) and not os.path.isdir(args.get(ARGSTR_DST)):
+    if args.get(ARGSTR_SRC) and args.get(ARGSTR_DST) and not PATH_STAT_CACHE.isdir(args.get(ARGSTR_DST)):
         if len(src_list) == 1 and not (args.get(ARGSTR_SRCLIST) or args.get(ARGSTR_SRCLIST_ROOTED)):
             arg_dst_can_be_file = True
 
 
-    ### Build list of tasks to be performed
+    if args.get(ARGSTR_DEBUG) and args.get(ARGSTR_SRCLIST_CHECK_BYDIR):
+        print("Source path existence check by directory: {} paths checked with {} directory listings and {} stat calls".format(
+            SRCLIST_CHECK_BYDIR_COUNTS['paths'], SRCLIST_CHECK_BYDIR_COUNTS['listings'], SRCLIST_CHECK_BYDIR_COUNTS['stats']))
+
+
+    ### Decide the type of each destination path before any task is performed
+
+    try:
+        dst_path_type_dict = get_dst_path_types(
+            args, arg_dst, srclist_tasklists, srclist_rooted_tasklists
+        )
+    except su.DimensionError as e:
+        arg_parser.error("Source list is not structured consistently: {}".format(e))
+        dst_path_type_dict = None
+
+
+    ### Open transfer journal, so that tasks completed by a previous run are dropped from the stream
+
+    journal = None
+    if (    args.get(ARGSTR_JOURNAL) is not None and not args.get(ARGSTR_DRYRUN)
+        and args.get(su.ARGSTR_SCHEDULER) is None):
+        journal = TaskJournal(args.get(ARGSTR_JOURNAL))
+
+
+    ### Build (lazy) stream of tasks to be performed
+
+    all_task_list = iter_tasks(
+        args, arg_dst, arg_dst_can_be_file,
+        src_list, srclist_tasklists, srclist_rooted_tasklists, dst_path_type_dict,
+        journal=journal
+    )
+
+
+    ### Create output directories if they don't already exist
+    if not args.get(ARGSTR_DRYRUN):
+        su.create_argument_directories(args, *ARGGRP_OUTDIR)
+
+
+    ### Perform tasks
+
+    error_trace = None
+    try:
+        if args.get(su.ARGSTR_SCHEDULER) is not None:
+            ## Submit tasks to scheduler
+            parent_tasks = list(all_task_list)
+            parent_args = args
+            child_args = copy.deepcopy(args)
+            child_args.unset(su.ARGGRP_SCHEDULER)
+            child_args.unset(ARGSTR_TRANSPLANT_TREE)
+            child_args.set(ARGSTR_SYNC_TREE)
+            if args.get(ARGSTR_BUNDLE_BY_SIZE):
+                # Each cost-balanced bundle is submitted on its own as a single job
+                task_bundles = bundle_tasks_by_cost(args, parent_tasks)
+                bundle_run_id = "{}_{}".format(time.strftime('%Y%m%d%H%M%S'), os.getpid())
+            else:
+                task_bundles = [parent_tasks]
+            for bundle_num, bundle_tasks in enumerate(task_bundles):
+                bundle_args = parent_args
+                if args.get(ARGSTR_BUNDLE_BY_SIZE):
+                    bundle_args = get_bundle_args(parent_args, bundle_run_id, bundle_num, len(bundle_tasks))
+                su.submit_tasks_to_scheduler(bundle_args, bundle_tasks,
+                                             BUNDLE_TASK_ARGSTRS, BUNDLE_LIST_ARGSTR,
+                                             child_args,
+                                             task_items_descr=BUNDLE_LIST_DESCR,
+                                             task_delim=ARGSTR_SRCLIST_DELIM,
+                                             python_version_accepted_min=PYTHON_VERSION_ACCEPTED_MIN,
+                                             dryrun=args.get(ARGSTR_DRYRUN))
+            sys.exit(0)
+
+        ## Perform tasks (in serial, or in parallel if multiple workers were requested)
+        perform_tasks(args, all_task_list, journal)
+
+    except KeyboardInterrupt:
+        raise
+
+    except Exception as e:
+        error_trace = su.handle_task_exception(e, args, JOBSCRIPT_INIT)
+
+    if type(args.get(su.ARGSTR_EMAIL)) is str:
+        su.send_script_completion_email(args, error_trace)
+
+    sys.exit(1 if error_trace is not None else 0)
+
+
+class TransferMetrics(object):
+    """Counts of transferred files and bytes, with per-operation latency histograms.
+
+    Latencies are binned into power-of-two microsecond buckets, where bucket `b`
+    holds latencies in the range [2^b, 2^(b+1)) microseconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.nfiles = 0
+        self.nbytes = 0
+        self.op_stats = {}
+
+    def record(self, op, seconds, nfiles=0, nbytes=0):
+        latency_us = seconds * 1e6
+        bucket = int(math.log(latency_us, 2)) if latency_us >= 1 else 0
+        with self.lock:
+            self.nfiles += nfiles
+            self.nbytes += nbytes
+            op_stat = self.op_stats.setdefault(op, {'count': 0, 'total_sec': 0.0, 'hist_log2_us': {}})
+            op_stat['count'] += 1
+            op_stat['total_sec'] += seconds
+            op_stat['hist_log2_us'][bucket] = op_stat['hist_log2_us'].get(bucket, 0) + 1
+
+    def drain(self):
+        with self.lock:
+            snapshot = (self.nfiles, self.nbytes, self.op_stats)
+            self.nfiles, self.nbytes, self.op_stats = 0, 0, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        nfiles, nbytes, op_stats = snapshot
+        with self.lock:
+            self.nfiles += nfiles
+            self.nbytes += nbytes
+            for op, other_stat in op_stats.items():
+                op_stat = self.op_stats.setdefault(op, {'count': 0, 'total_sec': 0.0, 'hist_log2_us': {}})
+                op_stat['count'] += other_stat['count']
+                op_stat['total_sec'] += other_stat['total_sec']
+                for bucket, count in other_stat['hist_log2_us'].items():
+                    op_stat['hist_log2_us'][bucket] = op_stat['hist_log2_us'].get(bucket, 0) + count
+
+    @staticmethod
+    def get_percentile_us(hist_log2_us, percentile):
+        total_count = sum(hist_log2_us.values())
+        target_count = total_count * percentile / 100.0
+        count = 0
+        for bucket in sorted(hist_log2_us):
+            count += hist_log2_us[bucket]
+            if count >= target_count:
+                return 2**(bucket+1)
+        return 0
+
+    def get_record(self):
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            return {
+                'time': time.time(),
+                'elapsed_sec': elapsed,
+                'files': self.nfiles,
+                'bytes': self.nbytes,
+                'files_per_sec': self.nfiles / elapsed if elapsed > 0 else 0,
+                'bytes_per_sec': self.nbytes / elapsed if elapsed > 0 else 0,
+                'ops': copy.deepcopy(self.op_stats),
+            }
+
+    def get_progress_line(self, record, prev_record=None):
+        if prev_record is None:
+            prev_record = {'elapsed_sec': 0, 'files': 0, 'bytes': 0}
+        interval = record['elapsed_sec'] - prev_record['elapsed_sec']
+        interval_files_per_sec = (record['files'] - prev_record['files']) / interval if interval > 0 else 0
+        interval_bytes_per_sec = (record['bytes'] - prev_record['bytes']) / interval if interval > 0 else 0
+        op_summaries = [
+            "{} n={} p50<{}us p99<{}us".format(
+                op, op_stat['count'],
+                self.get_percentile_us(op_stat['hist_log2_us'], 50),
+                self.get_percentile_us(op_stat['hist_log2_us'], 99))
+            for op, op_stat in sorted(record['ops'].items())
+        ]
+        return "PROGRESS: {:.0f}s elapsed, {} files ({:.1f} files/s), {:.1f} MB ({:.1f} MB/s); {}".format(
+            record['elapsed_sec'], record['files'], interval_files_per_sec,
+            record['bytes']/1e6, interval_bytes_per_sec/1e6, '; '.join(op_summaries)
+        )
+
+
+class ProgressReporter(object):
+    """Background thread that periodically reports transfer metrics."""
+
+    def __init__(self, metrics, interval=None, metrics_file=None, silent=False):
+        self.metrics = metrics
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.silent = silent
+        self.prev_record = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval is not None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def report(self, final=False):
+        record = self.metrics.get_record()
+        record['final'] = final
+        if not self.silent:
+            print(self.metrics.get_progress_line(record, None if final else self.prev_record))
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a') as metrics_fp:
+                metrics_fp.write(json.dumps(record)+'\n')
+        self.prev_record = record
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report(final=True)
+
+
+class InstrumentedCopyMethod(object):
+    """Wrapper of a copy method object that records the latency of each file transfer.
+
+    The destination directory is created through the shared directory cache first,
+    so that its creation is recorded for every copy method.
+    Only transfers that are actually performed are counted, so nothing is recorded
+    in dryrun mode. Existing destination files of file tasks are skipped before the
+    copy method is reached, but files within a directory walk are not, so with
+    `check_dst` nothing is recorded when the destination file already exists.
+    """
+
+    def __init__(self, copy_method, metrics_op, dryrun=False, check_dst=False):
+        self.copy_method = copy_method
+        self.metrics_op = metrics_op
+        self.dryrun = dryrun
+        self.check_dst = check_dst
+
+    def __getattr__(self, name):
+        return getattr(self.copy_method, name)
+
+    def exec(self, srcfile, dstfile, *args, **kwargs):
+        if self.dryrun or (self.check_dst and os.path.isfile(dstfile)):
+            return self.copy_method.exec(srcfile, dstfile, *args, **kwargs)
+        dstdir = os.path.dirname(dstfile)
+        if dstdir != '':
+            start_time = time.time()
+            if DIR_CACHE.ensure(dstdir):
+                WORKER_METRICS.record(METRICS_OP_MKDIR, time.time() - start_time)
+        try:
+            nbytes = os.stat(srcfile).st_size
+        except OSError:
+            nbytes = 0
+        start_time = time.time()
+        result = self.copy_method.exec(srcfile, dstfile, *args, **kwargs)
+        WORKER_METRICS.record(self.metrics_op, time.time() - start_time, nfiles=1, nbytes=nbytes)
+        return result
+
+
+class ZeroCopyMethod(object):
+    """File copy method that avoids copying file data through userspace.
+
+    Copy engines are attempted in order of preference: a reflink clone of the
+    whole file, `os.copy_file_range` (only if ZEROCOPY_USE_COPY_FILE_RANGE is
+    set), `os.sendfile`, and finally a userspace copy through a large reusable
+    buffer. An engine that is unsupported by the system or filesystem is not
+    attempted again for the rest of the run.
+    Provides the same `set_options`/`exec` interface as script_utils copy methods.
+    """
+
+    def __init__(self):
+        self.copy_overwrite = False
+        self.dryrun = False
+        self.verbose = True
+        self.debug = False
+        self.reflink_supported = (fcntl is not None)
+        self.copy_file_range_supported = ZEROCOPY_USE_COPY_FILE_RANGE and hasattr(os, 'copy_file_range')
+        self.sendfile_supported = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+        self.large_file_threshold_bytes = None
+        self.large_file_workers = 1
+        self._thread_local = threading.local()
+
+    def set_options(self, copy_overwrite=False, dryrun=False, verbose=True, debug=False):
+        self.copy_overwrite = copy_overwrite
+        self.dryrun = dryrun
+        self.verbose = verbose
+        self.debug = debug
+
+    def set_large_file_options(self, threshold_bytes=None, workers=1):
+        self.large_file_threshold_bytes = threshold_bytes
+        self.large_file_workers = workers
+
+    def exec(self, srcfile, dstfile):
+        dstfile_exists = os.path.isfile(dstfile)
+        if dstfile_exists and not self.copy_overwrite:
+            if self.verbose:
+                print("Destination file already exists, skipping: {}".format(dstfile))
+            return
+        if self.verbose:
+            print("{}COPYING: {} --> {}".format("(dryrun) "*self.dryrun, srcfile, dstfile))
+        if self.dryrun:
+            return
+
+        dstdir = os.path.dirname(dstfile)
+        if dstdir != '':
+            DIR_CACHE.ensure(dstdir)
+
+        src_stat = os.stat(srcfile)
+        src_size = src_stat.st_size
+
+        if (    self.large_file_threshold_bytes is not None and self.large_file_workers > 1
+            and src_size >= self.large_file_threshold_bytes):
+            self._copy_chunked(srcfile, dstfile, src_stat)
+            engine = 'chunked copy ({} workers)'.format(self.large_file_workers)
+        else:
+            if dstfile_exists:
+                # Replace rather than truncate, so other hard links to the file are not modified
+                os.remove(dstfile)
+            with open(srcfile, 'rb') as src_fp, open(dstfile, 'wb') as dst_fp:
+                engine = self._copy_fd(src_fp.fileno(), dst_fp.fileno(), src_size)
+            shutil.copystat(srcfile, dstfile)
+
+        if self.debug:
+            print("Copied {} bytes with {}: {}".format(src_size, engine, dstfile))
+
+    def _copy_chunked(self, srcfile, dstfile, src_stat):
+        # Byte ranges are copied concurrently into a preallocated temporary file
+        # next to the destination, which replaces the destination only once all
+        # bytes have been copied and the source is seen to be unchanged.
+        src_size = src_stat.st_size
+        tmpfile = "{}.partial-{}".format(dstfile, os.getpid())
+        chunk_ranges = [
+            (offset, min(LARGE_FILE_CHUNK_BYTES, src_size - offset))
+            for offset in range(0, src_size, LARGE_FILE_CHUNK_BYTES)
+        ]
+        try:
+            with open(srcfile, 'rb') as src_fp, open(tmpfile, 'wb') as dst_fp:
+                src_fd, dst_fd = src_fp.fileno(), dst_fp.fileno()
+                try:
+                    os.posix_fallocate(dst_fd, 0, src_size)
+                except (AttributeError, OSError):
+                    os.ftruncate(dst_fd, src_size)
+                with ThreadPoolExecutor(max_workers=self.large_file_workers) as chunk_executor:
+                    copied_size = sum(chunk_executor.map(
+                        lambda chunk_range: self._copy_range(src_fd, dst_fd, *chunk_range), chunk_ranges))
+            if copied_size != src_size:
+                raise IOError("Chunked copy of {} copied {} bytes, but expected {} bytes".format(
+                    srcfile, copied_size, src_size))
+            src_stat_after = os.stat(srcfile)
+            if (src_stat_after.st_size, src_stat_after.st_mtime) != (src_size, src_stat.st_mtime):
+                raise IOError("Source file was modified during chunked copy: {}".format(srcfile))
+            shutil.copystat(srcfile, tmpfile)
+            os.rename(tmpfile, dstfile)
+        except BaseException:
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+            raise
+
+    def _copy_range(self, src_fd, dst_fd, offset, count):
+        # Returns the number of bytes copied, which is short of `count` if the
+        # source file was truncated during the copy
+        start, end = offset, offset + count
+        if self.copy_file_range_supported:
+            try:
+                while offset < end:
+                    nbytes = os.copy_file_range(src_fd, dst_fd, end - offset, offset, offset)
+                    if nbytes == 0:
+                        break
+                    offset += nbytes
+                if offset >= end:
+                    return offset - start
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+        while offset < end:
+            data = os.pread(src_fd, min(COPY_BUFFER_BYTES, end - offset), offset)
+            if not data:
+                break
+            written = 0
+            while written < len(data):
+                written += os.pwrite(dst_fd, data[written:], offset + written)
+            offset += len(data)
+        return offset - start
+
+    def _copy_fd(self, src_fd, dst_fd, src_size):
+        if self.reflink_supported:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return 'reflink'
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM):
+                    raise
+                if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY):
+                    self.reflink_supported = False
+
+        offset = 0
+        if self.copy_file_range_supported:
+            try:
+                offset = self._copy_fd_kernel(os.copy_file_range, src_fd, dst_fd, src_size, offset)
+                if offset >= src_size:
+                    return 'copy_file_range'
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+                if e.errno in (errno.ENOSYS, errno.EOPNOTSUPP):
+                    self.copy_file_range_supported = False
+
+        if self.sendfile_supported:
+            try:
+                offset = self._copy_fd_kernel(self._sendfile, src_fd, dst_fd, src_size, offset)
+                if offset >= src_size:
+                    return 'sendfile'
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                self.sendfile_supported = False
+
+        self._copy_fd_buffered(src_fd, dst_fd, offset)
+        return 'buffered'
+
+    @staticmethod
+    def _sendfile(src_fd, dst_fd, count, offset_src):
+        return os.sendfile(dst_fd, src_fd, offset_src, count)
+
+    @staticmethod
+    def _copy_fd_kernel(copy_fn, src_fd, dst_fd, src_size, offset):
+        # Resumes from `offset` (bytes already copied) in case of a fallback between engines
+        # (both engines read from an explicit source offset and write at the
+        #  current destination file position, advancing it)
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+        while offset < src_size:
+            nbytes = copy_fn(src_fd, dst_fd, min(KERNEL_COPY_CHUNK_BYTES, src_size - offset), offset)
+            if nbytes == 0:
+                # Source file was truncated during copy
+                break
+            offset += nbytes
+        return offset
+
+    def _copy_fd_buffered(self, src_fd, dst_fd, offset):
+        # One copy buffer is allocated per worker thread and reused for all files
+        if getattr(self._thread_local, 'buffer', None) is None:
+            self._thread_local.buffer = bytearray(COPY_BUFFER_BYTES)
+        buffer_view = memoryview(self._thread_local.buffer)
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+        with open(src_fd, 'rb', buffering=0, closefd=False) as src_raw, \
+             open(dst_fd, 'wb', buffering=0, closefd=False) as dst_raw:
+            while True:
+                nbytes = src_raw.readinto(buffer_view)
+                if not nbytes:
+                    break
+                written = 0
+                while written < nbytes:
+                    written += dst_raw.write(buffer_view[written:nbytes])
+
+
+COPY_METHOD_FUNCTION_DICT[ARGCHO_COPY_METHOD_ZEROCOPY] = ZeroCopyMethod()
+
+
+PathStat = collections.namedtuple('PathStat', ['st_mode', 'st_size', 'st_mtime'])
+
+
+class PathStatCache(object):
+    """Cache of `os.stat` results keyed by path.
+
+    Each path is stat'ed at most once (while it remains in the cache), and the
+    result is shared by source list validation, destination path resolution,
+    and task execution. Only the mode, size and modification time of a path are
+    kept (as a `PathStat`), and a path that does not exist is cached as None.
+    """
+
+    def __init__(self, max_entries=PATH_STAT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.stat_dict = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stat(self, path):
+        with self.lock:
+            if path in self.stat_dict:
+                self.hits += 1
+                self.stat_dict.move_to_end(path)
+                return self.stat_dict[path]
+            self.misses += 1
+        start_time = time.time()
+        try:
+            os_stat = os.stat(path)
+            path_stat = PathStat(os_stat.st_mode, os_stat.st_size, os_stat.st_mtime)
+        except OSError:
+            path_stat = None
+        if WORKER_METRICS is not None:
+            WORKER_METRICS.record(METRICS_OP_STAT, time.time() - start_time)
+        with self.lock:
+            self.stat_dict[path] = path_stat
+            if len(self.stat_dict) > self.max_entries:
+                self.stat_dict.popitem(last=False)
+        return path_stat
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        path_stat = self.stat(path)
+        return path_stat is not None and stat.S_ISDIR(path_stat.st_mode)
+
+    def isfile(self, path):
+        path_stat = self.stat(path)
+        return path_stat is not None and stat.S_ISREG(path_stat.st_mode)
+
+    def drain_counts(self):
+        with self.lock:
+            counts = (self.hits, self.misses)
+            self.hits, self.misses = 0, 0
+        return counts
+
+    def merge_counts(self, counts):
+        hits, misses = counts
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def report(self):
+        return "Path stat cache: {} hits, {} misses ({} paths cached)".format(
+            self.hits, self.misses, len(self.stat_dict))
+
+
+PATH_STAT_CACHE = PathStatCache()
+DIR_CACHE = DirectoryCache()
+
+
+class TaskJournal(object):
+    """Append-only journal of completed (src, dst, size, mtime) task records.
+
+    Records from an existing journal are loaded into memory on open, so that
+    tasks completed by a previous run can be skipped without redoing them.
+    Tasks are keyed by the source path and the destination argument as given
+    (before destination path adjustment), and only single-file tasks are
+    recorded, since a directory's own size and modification time do not
+    reflect changes to the files within it. Records are tab-delimited lines,
+    so tasks whose paths contain a tab or newline are never recorded (and are
+    always redone).
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.completed_dict = {}
+        self.pending_dict = {}
+        self.num_skipped = 0
+        self.num_recorded = 0
+        self._num_unsynced = 0
+        self._last_sync_time = time.time()
+        self._load()
+        self.journal_fp = open(self.journal_file, 'a')
+
+    def _load(self):
+        if not os.path.isfile(self.journal_file):
+            return
+        with open(self.journal_file, 'r') as journal_fp:
+            for line in journal_fp:
+                record = line.rstrip('\n').split(JOURNAL_DELIM)
+                if len(record) != 4:
+                    # Likely a partial record written as the previous run was killed
+                    continue
+                src, dst, size, mtime = record
+                self.completed_dict[(src, dst)] = (int(size), float(mtime))
+
+    def skip_completed(self, src_path, arg_dst):
+        key = (src_path, arg_dst)
+        if key not in self.completed_dict:
+            return False
+        src_stat = PATH_STAT_CACHE.stat(src_path)
+        # A source that no longer exists (e.g. it was moved) is considered done
+        if src_stat is None or (
+                stat.S_ISREG(src_stat.st_mode)
+                and (src_stat.st_size, src_stat.st_mtime) == self.completed_dict[key]):
+            self.num_skipped += 1
+            return True
+        return False
+
+    def track(self, task, arg_dst):
+        if not PATH_STAT_CACHE.isfile(task[0]):
+            return
+        for path in (task[0], arg_dst):
+            if JOURNAL_DELIM in path or '\n' in path:
+                sys.stderr.write("WARNING: Task cannot be recorded in transfer journal "
+                                 "because a path contains a tab or newline: {!r}\n".format(path))
+                return
+        self.pending_dict[task] = (task[0], arg_dst)
+
+    def record(self, task):
+        key = self.pending_dict.pop(task, None)
+        if key is None:
+            return
+        src_stat = PATH_STAT_CACHE.stat(key[0])
+        if src_stat is None:
+            return
+        self.journal_fp.write(JOURNAL_DELIM.join([
+            key[0], key[1], str(src_stat.st_size), repr(src_stat.st_mtime)
+        ])+'\n')
+        self.num_recorded += 1
+        self._num_unsynced += 1
+        if (   self._num_unsynced >= JOURNAL_FSYNC_INTERVAL_RECORDS
+            or time.time() - self._last_sync_time >= JOURNAL_FSYNC_INTERVAL_SEC):
+            self.sync()
+
+    def sync(self):
+        self.journal_fp.flush()
+        os.fsync(self.journal_fp.fileno())
+        self._num_unsynced = 0
+        self._last_sync_time = time.time()
+
+    def close(self):
+        self.sync()
+        self.journal_fp.close()
+
+
+class GlobIndex(object):
+    """Pathname pattern expansion with the same results as `glob.glob`.
+
+    Directory listings are cached (with an LRU bound) and each pattern is
+    compiled once, so that many patterns sharing the same parent directories
+    are matched against one listing of each directory instead of relisting
+    the directory for every pattern.
+    """
+
+    def __init__(self, max_listings=GLOB_INDEX_MAX_LISTINGS):
+        self.max_listings = max_listings
+        self.listing_dict = collections.OrderedDict()
+        self.pattern_dict = {}
+        self.hits = 0
+        self.misses = 0
+
+    def glob(self, pathname):
+        return list(self._iglob(pathname, False))
+
+    def report(self):
+        return "Glob index: {} directory listing hits, {} misses ({} listings cached)".format(
+            self.hits, self.misses, len(self.listing_dict))
+
+    def _list(self, dirname):
+        if dirname in self.listing_dict:
+            self.hits += 1
+            self.listing_dict.move_to_end(dirname)
+            return self.listing_dict[dirname]
+        self.misses += 1
+        try:
+            # List of (name, is_dir) tuples in directory order
+            listing = [(dirent.name, dirent.is_dir()) for dirent in os.scandir(dirname)]
+        except OSError:
+            listing = []
+        self.listing_dict[dirname] = listing
+        if len(self.listing_dict) > self.max_listings:
+            self.listing_dict.popitem(last=False)
+        return listing
+
+    def _compile(self, pattern):
+        pattern_regex = self.pattern_dict.get(pattern)
+        if pattern_regex is None:
+            pattern_regex = re.compile(fnmatch.translate(pattern))
+            self.pattern_dict[pattern] = pattern_regex
+        return pattern_regex
+
+    def _iglob(self, pathname, dironly):
+        dirname, basename = os.path.split(pathname)
+        if not GLOB_MAGIC_CHECK.search(pathname):
+            if basename:
+                if (os.path.isdir if dironly else os.path.lexists)(pathname):
+                    yield pathname
+            elif os.path.isdir(dirname):
+                yield pathname
+            return
+        if not dirname:
+            for name in self._glob_in_dir(dirname, basename, dironly):
+                yield name
+            return
+        if dirname != pathname and GLOB_MAGIC_CHECK.search(dirname):
+            dirs = self._iglob(dirname, True)
+        else:
+            dirs = [dirname]
+        glob_in_dir = self._glob_in_dir if GLOB_MAGIC_CHECK.search(basename) else self._glob0
+        for dirname in dirs:
+            for name in glob_in_dir(dirname, basename, dironly):
+                yield os.path.join(dirname, name)
+
+    def _glob_in_dir(self, dirname, pattern, dironly):
+        pattern_regex = self._compile(pattern)
+        include_hidden = pattern.startswith('.')
+        for name, is_dir in self._list(dirname if dirname else os.curdir):
+            if dironly and not is_dir:
+                continue
+            if name.startswith('.') and not include_hidden:
+                continue
+            if pattern_regex.match(name):
+                yield name
+
+    def _glob0(self, dirname, basename, dironly):
+        if not basename:
+            if os.path.isdir(dirname):
+                yield basename
+            return
+        listing = self.listing_dict.get(dirname)
+        if listing is None:
+            if (os.path.isdir if dironly else os.path.lexists)(os.path.join(dirname, basename)):
+                yield basename
+            return
+        for name, is_dir in listing:
+            if name == basename and (is_dir or not dironly):
+                yield basename
+                return
+
+
+GLOB_INDEX = GlobIndex()
+
+
+class SrclistStream(object):
+    """Line-by-line reader of a source list textfile.
+
+    Only the first two lines are read on construction to determine the list
+    format, then the file is re-read lazily on each iteration so that the
+    full list of tasks is never held in memory.
+    Iteration yields each task as a list of [src_path] or [src_path, dst_path].
+    """
+
+    def __init__(self, srclist_file, args_delim=ARGDEF_SRCLIST_DELIM, rooted=False):
+        self.tasklist_file = srclist_file
+        self.args_delim = args_delim
+        self.rooted = rooted
+        self.header = None
+        self.header_is_task = False
+        self.ncol = None
+        self.empty = False
+        self._read_header()
+
+    def _iter_line_items(self):
+        with open(self.tasklist_file, 'r') as srclist_fp:
+            for line_num, line in enumerate(srclist_fp):
+                line = line.strip()
+                if line == '':
+                    continue
+                line_items = [item.strip() for item in line.split(self.args_delim)]
+                if len(line_items) > 2:
+                    raise su.DimensionError("{} line {} has more than 2 columns: {}".format(
+                        self.tasklist_file, line_num+1, line))
+                yield line_num, line_items
+
+    def _read_header(self):
+        line_items_iter = self._iter_line_items()
+        first_line = next(line_items_iter, None)
+        second_line = next(line_items_iter, None)
+        line_items_iter.close()
+
+        if first_line is None:
+            self.empty = True
+            return
+        first_items = first_line[1]
+        second_items = second_line[1] if second_line is not None else None
+
+        if self.rooted:
+            self.header = first_items
+            self.ncol = len(second_items) if second_items is not None else None
+        elif second_items is None:
+            self.ncol = len(first_items)
+        elif len(first_items) == 2 and len(second_items) == 1:
+            # 'src_path,dst_dir' header line followed by 'src_path' line items
+            self.header = first_items
+            self.header_is_task = True
+            self.ncol = 1
+        elif len(first_items) == len(second_items):
+            self.ncol = len(first_items)
+        else:
+            raise su.DimensionError("{} first line has {} columns, but second line has {} columns".format(
+                self.tasklist_file, len(first_items), len(second_items)))
+
+    def __iter__(self):
+        if self.empty:
+            return
+        line_items_iter = self._iter_line_items()
+        if self.header is not None:
+            _, header_items = next(line_items_iter)
+            if self.header_is_task:
+                yield [header_items[0]]
+        for line_num, line_items in line_items_iter:
+            if len(line_items) != self.ncol:
+                raise su.DimensionError("{} line {} has {} columns, but expected {} columns".format(
+                    self.tasklist_file, line_num+1, len(line_items), self.ncol))
+            yield line_items
+
+
+def find_missing_srclist_sources(tasklist, arg_parser, srclist_argstr, check_bydir=False):
+    tasklist_src_dne = []
+    try:
+        task_src_iter = (task[0] for task in tasklist)
+        if check_bydir:
+            tasklist_src_dne = find_missing_paths_bydir(task_src_iter)
+        else:
+            for task_src in task_src_iter:
+                if not PATH_STAT_CACHE.exists(task_src):
+                    tasklist_src_dne.append(task_src)
+    except su.DimensionError as e:
+        arg_parser.error("{} {} is not structured consistently: {}".format(
+            srclist_argstr, tasklist.tasklist_file, e))
+    return tasklist_src_dne
+
+
+def find_missing_paths_bydir(path_iter):
+    missing_paths = []
+    path_chunk = []
+    for path in path_iter:
+        path_chunk.append(path)
+        if len(path_chunk) >= SRCLIST_CHECK_BYDIR_CHUNK_SIZE:
+            missing_paths.extend(_find_missing_paths_bydir_chunk(path_chunk))
+            path_chunk = []
+    if len(path_chunk) > 0:
+        missing_paths.extend(_find_missing_paths_bydir_chunk(path_chunk))
+    return missing_paths
+
+def _find_missing_paths_bydir_chunk(path_chunk):
+    counts = SRCLIST_CHECK_BYDIR_COUNTS
+    counts['paths'] += len(path_chunk)
+
+    parent_fnames_dict = collections.OrderedDict()
+    for path in path_chunk:
+        parent, fname = os.path.split(path)
+        parent_fnames_dict.setdefault(parent, []).append((path, fname))
+
+    missing_paths = []
+    for parent, path_fname_list in parent_fnames_dict.items():
+        parent_dirents = None
+        if len(path_fname_list) > 1:
+            try:
+                counts['listings'] += 1
+                # Symlinks are recorded separately, since a broken link does not "exist"
+                parent_dirents = {}
+                for dirent in os.scandir(parent if parent != '' else os.curdir):
+                    parent_dirents[dirent.name] = dirent.is_symlink()
+            except OSError:
+                parent_dirents = None
+        for path, fname in path_fname_list:
+            if parent_dirents is not None and fname in parent_dirents and not parent_dirents[fname]:
+                continue
+            # Fall back to stat for singleton parents, links, and names not found
+            # in the listing (such as trailing separators and '..' components).
+            counts['stats'] += 1
+            if not PATH_STAT_CACHE.exists(path):
+                missing_paths.append(path)
+    return missing_paths
+
+
+def get_path_type(path):
+    try:
+        path_mode = os.stat(path).st_mode
+    except OSError:
+        return PATH_TYPE_DNE
+    if stat.S_ISDIR(path_mode):
+        return PATH_TYPE_DIR
+    elif stat.S_ISREG(path_mode):
+        return PATH_TYPE_FILE
+    else:
+        return PATH_TYPE_UNKNOWN
+
+
+def get_dst_path_types(args, arg_dst, srclist_tasklists, srclist_rooted_tasklists):
+    # Tasks are built while earlier tasks are already being performed, and those tasks
+    # may create destination directories. So the type of every distinct destination path
+    # (argument, source list header, or source list line item) is decided here, before
+    # any task is performed, and held for the whole run in a dict that is never evicted.
+    dst_path_type_dict = {}
+
+    def add_dst_path(dst_path):
+        if dst_path not in dst_path_type_dict:
+            dst_path_type_dict[dst_path] = get_path_type(dst_path)
+
+    dstdir_global = (arg_dst is not None and args.get(ARGSTR_DSTDIR_GLOBAL) is not None)
+    if arg_dst is not None:
+        add_dst_path(arg_dst)
+
+    for tasklist in srclist_tasklists:
+        if dstdir_global:
+            continue
+        elif tasklist.header is not None:
+            add_dst_path(tasklist.header[1])
+        elif tasklist.ncol == 2:
+            for task in tasklist:
+                add_dst_path(task[1])
+
+    for tasklist in srclist_rooted_tasklists:
+        if dstdir_global or len(tasklist.header) == 2:
+            continue
+        elif tasklist.ncol == 2:
+            for task in tasklist:
+                add_dst_path(task[1])
+
+    return dst_path_type_dict
+
 
-    all_task_list = []
+def iter_tasks(args, arg_dst, arg_dst_can_be_file, src_list, srclist_tasklists, srclist_rooted_tasklists,
+               dst_path_type_dict, journal=None):
+    check_src_in_stream = args.get(ARGSTR_SRCLIST_NOCHECK)
 
     ## Standardize source and destination paths to SYNC-style for file copy tasks
 
     for src_path in src_list:
         dst_path = arg_dst
-        dst_path = adjust_dst_path(src_path, dst_path, arg_dst_can_be_file)
-        all_task_list.append((src_path, dst_path))
+        if journal is not None and journal.skip_completed(src_path, dst_path):
+            continue
+        task = (src_path, adjust_dst_path(
+            src_path, dst_path, arg_dst_can_be_file, dst_path_type_dict[dst_path]
+        ))
+        if journal is not None:
+            journal.track(task, dst_path)
+        yield task
 
     for tasklist in srclist_tasklists:
 
@@ -547,45 +1676,39 @@ def main():
             tasklist_dst_dir = None
             tasklist_dst_can_be_file = True
 
-        if tasklist_dst_dir is None:
-            dst_path_type = PATH_TYPE_UNKNOWN
-        else:
-            if not os.path.exists(tasklist_dst_dir):
-                dst_path_type = PATH_TYPE_DNE
-            elif os.path.isdir(tasklist_dst_dir):
-                dst_path_type = PATH_TYPE_DIR
-            elif os.path.isfile(tasklist_dst_dir):
-                dst_path_type = PATH_TYPE_FILE
-            else:
-                dst_path_type = PATH_TYPE_UNKNOWN
-
-        for task in tasklist.tasks:
-            src_path = task[0] if type(task) is list else task
+        for task in tasklist:
+            src_path = task[0]
             dst_path = tasklist_dst_dir if tasklist_dst_dir is not None else task[1]
+            dst_path_type = dst_path_type_dict[dst_path]
             if not args.get(ARGSTR_SRCLIST_NOGLOB) and '*' in src_path:
-                src_path_glob = glob.glob(src_path)
+                src_path_glob = GLOB_INDEX.glob(src_path)
                 for src_path in src_path_glob:
-                    dst_path = adjust_dst_path(
+                    if journal is not None and journal.skip_completed(src_path, dst_path):
+                        continue
+                    task = (src_path, adjust_dst_path(
                         src_path, dst_path, dst_can_be_file=False, dst_path_type=dst_path_type,
                         sync_mode_default=ARGMOD_SYNC_MODE_TRANSPLANT_TREE
-                    )
-                    all_task_list.append((src_path, dst_path))
+                    ))
+                    if journal is not None:
+                        journal.track(task, dst_path)
+                    yield task
             else:
-                dst_path = adjust_dst_path(
+                if check_src_in_stream and not PATH_STAT_CACHE.exists(src_path):
+                    warn_missing_source(tasklist, src_path)
+                    continue
+                if journal is not None and journal.skip_completed(src_path, dst_path):
+                    continue
+                task = (src_path, adjust_dst_path(
                     src_path, dst_path, tasklist_dst_can_be_file, dst_path_type
-                )
-                all_task_list.append((src_path, dst_path))
+                ))
+                if journal is not None:
+                    journal.track(task, dst_path)
+                yield task
 
     for tasklist in srclist_rooted_tasklists:
 
         src_rootdir = tasklist.header[0]
 
-        if not os.path.isdir(src_rootdir):
-            arg_parser.error(
-                "{} {} source root directory in header must be an existing directory: {}".format(
-                ARGSTR_SRCLIST_ROOTED, tasklist.tasklist_file, src_rootdir
-            ))
-
         if arg_dst is not None and args.get(ARGSTR_DSTDIR_GLOBAL) is not None:
             tasklist_dst_rootdir = arg_dst
         elif len(tasklist.header) == 2:
@@ -602,104 +1725,389 @@ def main():
         if tasklist_dst_rootdir is not None and sync_mode == ARGMOD_SYNC_MODE_TRANSPLANT_TREE:
             tasklist_dst_rootdir = os.path.join(tasklist_dst_rootdir, src_rootdir_dirname)
 
-        for task in tasklist.tasks:
-            src_path = task[0] if type(task) is list else task
+        for task in tasklist:
+            src_path = task[0]
             dst_rootdir = tasklist_dst_rootdir if tasklist_dst_rootdir is not None else task[1]
-            if os.path.isfile(dst_rootdir):
-                arg_parser.error(
-                    "{} {} destination root directory in header cannot be an existing file: {}".format(
+            if tasklist_dst_rootdir is None and dst_path_type_dict[dst_rootdir] == PATH_TYPE_FILE:
+                raise su.ScriptArgumentError(
+                    "{} {} destination root directory cannot be an existing file: {}".format(
                     ARGSTR_SRCLIST_ROOTED, tasklist.tasklist_file, dst_rootdir
                 ))
             if not args.get(ARGSTR_SRCLIST_NOGLOB) and '*' in src_path:
-                src_path_glob = glob.glob(src_path)
+                src_path_glob = GLOB_INDEX.glob(src_path)
+            elif check_src_in_stream and not PATH_STAT_CACHE.exists(src_path):
+                warn_missing_source(tasklist, src_path)
+                continue
             else:
                 src_path_glob = [src_path]
             for src_path in src_path_glob:
 
+                if journal is not None and journal.skip_completed(src_path, dst_rootdir):
+                    continue
+
                 src_path_from_root = src_path.replace(src_rootdir, '') if src_path.startswith(src_rootdir) else src_path
                 if tasklist_dst_rootdir is None and sync_mode == ARGMOD_SYNC_MODE_TRANSPLANT_TREE:
                     dst_path = os.path.join(dst_rootdir, src_rootdir_dirname, src_path_from_root)
                 else:
                     dst_path = os.path.join(dst_rootdir, src_path_from_root)
 
-                all_task_list.append((src_path, dst_path))
+                task = (src_path, dst_path)
+                if journal is not None:
+                    journal.track(task, dst_rootdir)
+                yield task
 
 
-    ### Create output directories if they don't already exist
-    if not args.get(ARGSTR_DRYRUN):
-        su.create_argument_directories(args, *ARGGRP_OUTDIR)
+def warn_missing_source(tasklist, src_path):
+    sys.stderr.write("WARNING: {} source path does not exist, skipping: {}\n".format(
+        tasklist.tasklist_file, src_path))
 
 
-    ### Perform tasks
+def estimate_task_cost(task_srcpath, file_overhead_sec, bytes_per_sec, mindepth=0, maxdepth=float('inf')):
+    if PATH_STAT_CACHE.isfile(task_srcpath):
+        nbytes, nfiles = PATH_STAT_CACHE.stat(task_srcpath).st_size, 1
+    else:
+        # Only files within the depth range that will be copied are counted
+        nbytes, nfiles = 0, 0
+        for rootdir, dir_entries, file_entries in walk.walk_entries(task_srcpath, mindepth, maxdepth):
+            for file_entry in file_entries:
+                try:
+                    nbytes += file_entry.stat().st_size
+                except OSError:
+                    pass
+                nfiles += 1
+    return nbytes / bytes_per_sec + nfiles * file_overhead_sec
+
+
+def bundle_tasks_by_cost(args, task_list):
+    # Tasks are packed into bundles by estimated transfer cost rather than by count.
+    # The number of bundles is set so that each bundle fits within the job walltime,
+    # then tasks are assigned longest-processing-time-first to the bundle with the
+    # lowest estimated cost so far. A tasks-per-job setting is kept as the maximum
+    # number of tasks in a bundle.
+    if len(task_list) == 0:
+        return []
+
+    bytes_per_sec = args.get(ARGSTR_BUNDLE_THROUGHPUT) * 1e6
+    mindepth, maxdepth = args.get(ARGSTR_MINDEPTH), args.get(ARGSTR_MAXDEPTH)
+    task_cost_list = [
+        (estimate_task_cost(task[0], BUNDLE_FILE_OVERHEAD_SEC, bytes_per_sec, mindepth, maxdepth), task_num)
+        for task_num, task in enumerate(task_list)
+    ]
+    total_cost = sum(task_cost for task_cost, _ in task_cost_list)
+
+    bundle_cost_max = args.get(su.ARGSTR_JOB_WALLTIME) * 3600 * BUNDLE_WALLTIME_FILL_FRACTION
+    bundle_tasks_max = args.get(su.ARGSTR_TASKS_PER_JOB)
+    num_bundles = max(1, int(math.ceil(total_cost / bundle_cost_max)))
+    if bundle_tasks_max is not None:
+        num_bundles = max(num_bundles, int(math.ceil(len(task_list) / bundle_tasks_max)))
+    num_bundles = min(num_bundles, len(task_list))
+
+    bundle_heap = [(0, bundle_num) for bundle_num in range(num_bundles)]
+    bundle_task_nums = [[] for _ in range(num_bundles)]
+    bundle_costs = [0]*num_bundles
+    for task_cost, task_num in sorted(task_cost_list, reverse=True):
+        _, bundle_num = heapq.heappop(bundle_heap)
+        bundle_task_nums[bundle_num].append(task_num)
+        bundle_costs[bundle_num] += task_cost
+        if bundle_tasks_max is None or len(bundle_task_nums[bundle_num]) < bundle_tasks_max:
+            heapq.heappush(bundle_heap, (bundle_costs[bundle_num], bundle_num))
+
+    bundle_sizes = [len(task_nums) for task_nums in bundle_task_nums]
+    print("Bundling {} tasks (estimated {:.1f} hours total) into {} bundles of {}-{} tasks, "
+          "estimated {:.2f}-{:.2f} hours per bundle".format(
+        len(task_list), total_cost/3600, num_bundles, min(bundle_sizes), max(bundle_sizes),
+        min(bundle_costs)/3600, max(bundle_costs)/3600
+    ))
+    if max(bundle_costs) > bundle_cost_max:
+        print("WARNING: Largest bundle is estimated to exceed {:.0f}% of the job walltime".format(
+            BUNDLE_WALLTIME_FILL_FRACTION*100))
+
+    # Tasks keep their source list order within each bundle
+    return [[task_list[task_num] for task_num in sorted(task_nums)] for task_nums in bundle_task_nums]
+
+
+def get_bundle_args(parent_args, bundle_run_id, bundle_num, bundle_num_tasks):
+    # Scheduler arguments for submitting one cost-balanced bundle as a single job.
+    # The bundle's tasks-per-job is set to its number of tasks on a copy of the parent
+    # arguments, and each bundle gets its own bundle directory and job name, so that
+    # bundle files and job names of separate submissions never collide (even when the
+    # submissions are made within the same second).
+    bundle_args = copy.deepcopy(parent_args)
+    bundle_args.set(su.ARGSTR_TASKS_PER_JOB, bundle_num_tasks)
+    bundle_args.set(su.ARGSTR_JOB_ABBREV, "{}{}".format(parent_args.get(su.ARGSTR_JOB_ABBREV), bundle_num+1))
+    bundledir = os.path.join(
+        parent_args.get(su.ARGSTR_BUNDLEDIR), "{}_bundle{}".format(bundle_run_id, bundle_num+1)
+    )
+    if not parent_args.get(ARGSTR_DRYRUN) and not os.path.isdir(bundledir):
+        os.makedirs(bundledir)
+    bundle_args.set(su.ARGSTR_BUNDLEDIR, bundledir)
+    return bundle_args
+
+
+def get_task_options(args):
+    return {
+        'copy_method': args.get(ARGSTR_COPY_METHOD),
+        'overwrite': args.get(ARGSTR_OVERWRITE),
+        'update': args.get(ARGSTR_UPDATE),
+        'update_hash': args.get(ARGSTR_UPDATE_HASH),
+        'mindepth': args.get(ARGSTR_MINDEPTH),
+        'maxdepth': args.get(ARGSTR_MAXDEPTH),
+        'collapse_tree': args.get(ARGSTR_COLLAPSE_TREE),
+        'dryrun': args.get(ARGSTR_DRYRUN),
+        'silent': args.get(ARGSTR_SILENT),
+        'debug': args.get(ARGSTR_DEBUG),
+        'large_file_threshold': args.get(ARGSTR_LARGE_FILE_THRESHOLD),
+        'large_file_workers': args.get(ARGSTR_LARGE_FILE_WORKERS),
+        'metrics': (args.get(ARGSTR_PROGRESS) is not None or args.get(ARGSTR_METRICS_FILE) is not None),
+    }
+
+
+def init_task_worker(task_options, metrics=None, in_subprocess=False):
+    global WORKER_TASK_OPTIONS, WORKER_COPY_METHOD_OBJ, WORKER_WALK_OBJECT
+    global WORKER_METRICS, WORKER_METRICS_DRAIN, WORKER_IN_SUBPROCESS
+
+    # Worker processes return their stat cache counts with each task result
+    WORKER_IN_SUBPROCESS = in_subprocess
+
+    # Worker processes record metrics locally and return them with each task result
+    if task_options['metrics']:
+        WORKER_METRICS_DRAIN = (metrics is None)
+        WORKER_METRICS = metrics if metrics is not None else TransferMetrics()
+
+    # Out-of-date destination files must be overwritten in update mode
+    copy_overwrite = (task_options['overwrite'] or task_options['update'])
+
+    copy_method_obj = copy.copy(COPY_METHOD_FUNCTION_DICT[task_options['copy_method']])
+    copy_method_obj.set_options(
+        copy_overwrite=copy_overwrite,
+        dryrun=task_options['dryrun'],
+        verbose=(not task_options['silent']),
+        debug=task_options['debug']
+    )
+    if task_options['copy_method'] == ARGCHO_COPY_METHOD_ZEROCOPY and task_options['large_file_threshold'] is not None:
+        copy_method_obj.set_large_file_options(
+            threshold_bytes=int(task_options['large_file_threshold']*1024*1024*1024),
+            workers=task_options['large_file_workers']
+        )
+
+    walk_copy_method_obj = copy_method_obj
+    if task_options['metrics']:
+        metrics_op = COPY_METHOD_METRICS_OP_DICT[task_options['copy_method']]
+        walk_copy_method_obj = InstrumentedCopyMethod(
+            copy_method_obj, metrics_op, dryrun=task_options['dryrun'], check_dst=(not copy_overwrite)
+        )
+        copy_method_obj = InstrumentedCopyMethod(
+            copy_method_obj, metrics_op, dryrun=task_options['dryrun']
+        )
+
+    if task_options['update']:
+        walk_copy_method_obj = UpdateOnlyCopyMethod(walk_copy_method_obj, task_options['update_hash'])
 
-    error_trace = None
-    try:
-        if args.get(su.ARGSTR_SCHEDULER) is not None:
-            ## Submit tasks to scheduler
-            parent_tasks = all_task_list
-            parent_args = args
-            child_args = copy.deepcopy(args)
-            child_args.unset(su.ARGGRP_SCHEDULER)
-            child_args.unset(ARGSTR_TRANSPLANT_TREE)
-            child_args.set(ARGSTR_SYNC_TREE)
-            su.submit_tasks_to_scheduler(parent_args, parent_tasks,
-                                         BUNDLE_TASK_ARGSTRS, BUNDLE_LIST_ARGSTR,
-                                         child_args,
-                                         task_items_descr=BUNDLE_LIST_DESCR,
-                                         task_delim=ARGSTR_SRCLIST_DELIM,
-                                         python_version_accepted_min=PYTHON_VERSION_ACCEPTED_MIN,
-                                         dryrun=args.get(ARGSTR_DRYRUN))
-            sys.exit(0)
+    walk_object = su.WalkObject(
+        mindepth=task_options['mindepth'], maxdepth=task_options['maxdepth'],
+        copy_method=walk_copy_method_obj, copy_overwrite=copy_overwrite,
+        transplant_tree=False, collapse_tree=task_options['collapse_tree'],
+        copy_dryrun=task_options['dryrun'], copy_silent=task_options['silent'], copy_debug=task_options['debug']
+    )
 
-        ## Perform tasks in serial
-        perform_tasks(args, all_task_list)
+    WORKER_TASK_OPTIONS = task_options
+    WORKER_COPY_METHOD_OBJ = copy_method_obj
+    WORKER_WALK_OBJECT = walk_object
 
-    except KeyboardInterrupt:
-        raise
 
-    except Exception as e:
-        error_trace = su.handle_task_exception(e, args, JOBSCRIPT_INIT)
+def get_partial_hash(path, file_size):
+    path_hash = hashlib.md5()
+    with open(path, 'rb') as path_fp:
+        path_hash.update(path_fp.read(PARTIAL_HASH_CHUNK_BYTES))
+        if file_size > PARTIAL_HASH_CHUNK_BYTES:
+            path_fp.seek(max(PARTIAL_HASH_CHUNK_BYTES, file_size - PARTIAL_HASH_CHUNK_BYTES))
+            path_hash.update(path_fp.read(PARTIAL_HASH_CHUNK_BYTES))
+    return path_hash.digest()
 
-    if type(args.get(su.ARGSTR_EMAIL)) is str:
-        su.send_script_completion_email(args, error_trace)
 
-    sys.exit(1 if error_trace is not None else 0)
+def dst_file_is_up_to_date(src_file, dst_file, check_hash=False):
+    src_stat = PATH_STAT_CACHE.stat(src_file)
+    try:
+        dst_stat = os.stat(dst_file)
+    except OSError:
+        return False
+    if src_stat is None or not stat.S_ISREG(dst_stat.st_mode):
+        return False
+    if src_stat.st_size != dst_stat.st_size or src_stat.st_mtime > dst_stat.st_mtime:
+        return False
+    if check_hash:
+        return get_partial_hash(src_file, src_stat.st_size) == get_partial_hash(dst_file, dst_stat.st_size)
+    return True
 
 
-def perform_tasks(args, task_list):
+class UpdateOnlyCopyMethod(object):
+    """Wrapper of a copy method object that skips destination files that are up to date.
 
-    copy_method_obj = copy.copy(COPY_METHOD_FUNCTION_DICT[args.get(ARGSTR_COPY_METHOD)])
-    copy_method_obj.set_options(
-        copy_overwrite=args.get(ARGSTR_OVERWRITE),
-        dryrun=args.get(ARGSTR_DRYRUN),
-        verbose=(not args.get(ARGSTR_SILENT)),
-        debug=args.get(ARGSTR_DEBUG)
-    )
+    Used to apply the update check to files transferred within a directory walk.
+    """
 
-    walk_object = su.WalkObject(
-        mindepth=args.get(ARGSTR_MINDEPTH), maxdepth=args.get(ARGSTR_MAXDEPTH),
-        copy_method=copy_method_obj, copy_overwrite=args.get(ARGSTR_OVERWRITE),
-        transplant_tree=False, collapse_tree=args.get(ARGSTR_COLLAPSE_TREE),
-        copy_dryrun=args.get(ARGSTR_DRYRUN), copy_silent=args.get(ARGSTR_SILENT), copy_debug=args.get(ARGSTR_DEBUG)
-    )
+    def __init__(self, copy_method, check_hash=False):
+        self.copy_method = copy_method
+        self.check_hash = check_hash
+
+    def __getattr__(self, name):
+        return getattr(self.copy_method, name)
+
+    def exec(self, srcfile, dstfile, *args, **kwargs):
+        if dst_file_is_up_to_date(srcfile, dstfile, self.check_hash):
+            return
+        return self.copy_method.exec(srcfile, dstfile, *args, **kwargs)
 
-    for task_srcpath, task_dstpath in task_list:
-        if os.path.isfile(task_srcpath):
+
+def perform_task(task, catch_errors=False):
+    task_srcpath, task_dstpath = task
+    try:
+        if PATH_STAT_CACHE.isfile(task_srcpath):
             task_srcfile = task_srcpath
             task_dstfile = task_dstpath
-            copy_method_obj.exec(task_srcfile, task_dstfile)
+            if WORKER_TASK_OPTIONS['update']:
+                if dst_file_is_up_to_date(task_srcfile, task_dstfile, WORKER_TASK_OPTIONS['update_hash']):
+                    return TASK_STATUS_SKIPPED, None
+            elif not WORKER_TASK_OPTIONS['overwrite'] and os.path.isfile(task_dstfile):
+                # Reported here (instead of by the copy method) so the task counts as skipped
+                if not WORKER_TASK_OPTIONS['silent']:
+                    print("Destination file already exists, skipping: {}".format(task_dstfile))
+                return TASK_STATUS_SKIPPED, None
+            WORKER_COPY_METHOD_OBJ.exec(task_srcfile, task_dstfile)
         else:
             task_srcdir = task_srcpath
             task_dstdir = task_dstpath
-            walk_object.walk(task_srcdir, task_dstdir)
+            WORKER_WALK_OBJECT.walk(task_srcdir, task_dstdir)
+    except Exception:
+        if not catch_errors:
+            raise
+        return TASK_STATUS_FAILED, traceback.format_exc()
+    return TASK_STATUS_SUCCESS, None
+
+
+def perform_task_in_worker(task):
+    task_status, task_error_trace = perform_task(task, catch_errors=True)
+    metrics_snapshot = WORKER_METRICS.drain() if WORKER_METRICS_DRAIN else None
+    stat_cache_counts = PATH_STAT_CACHE.drain_counts() if WORKER_IN_SUBPROCESS else None
+    return task_status, task_error_trace, metrics_snapshot, stat_cache_counts
+
+
+def iter_bounded_results(executor, fn, task_iter, max_inflight):
+    # Results are yielded in task order, so at most `max_inflight` tasks
+    # are ever submitted to the executor ahead of the oldest unfinished task.
+    pending = collections.deque()
+    for task in task_iter:
+        pending.append((task, executor.submit(fn, task)))
+        if len(pending) >= max_inflight:
+            task, future = pending.popleft()
+            yield task, future.result()
+    while len(pending) > 0:
+        task, future = pending.popleft()
+        yield task, future.result()
+
+
+def perform_tasks(args, task_list, journal=None):
+
+    task_options = get_task_options(args)
+    num_workers = args.get(ARGSTR_WORKERS)
+
+    task_list = iter_prefetched(task_list, TASK_PREFETCH_QUEUE_SIZE)
+
+    metrics = None
+    progress_reporter = None
+    if task_options['metrics']:
+        metrics = TransferMetrics()
+        progress_reporter = ProgressReporter(
+            metrics, interval=args.get(ARGSTR_PROGRESS), metrics_file=args.get(ARGSTR_METRICS_FILE),
+            silent=task_options['silent']
+        )
+        progress_reporter.start()
+
+    try:
+        if num_workers <= 1:
+            init_task_worker(task_options, metrics)
+            for task in task_list:
+                task_status, _ = perform_task(task)
+                if journal is not None and task_status == TASK_STATUS_SUCCESS:
+                    journal.record(task)
+        else:
+            perform_tasks_parallel(task_options, task_list, num_workers, journal, metrics)
+    finally:
+        if progress_reporter is not None:
+            progress_reporter.stop()
+        if journal is not None:
+            journal.close()
+            if not task_options['silent']:
+                print("Transfer journal: {} tasks skipped as completed in a previous run, {} tasks recorded".format(
+                    journal.num_skipped, journal.num_recorded))
+
+    if task_options['debug']:
+        print(PATH_STAT_CACHE.report())
+        print(GLOB_INDEX.report())
+        print(DIR_CACHE.report())
+
+
+def perform_tasks_parallel(task_options, task_list, num_workers, journal=None, metrics=None):
+
+    # Worker output would interleave, so per-file printing is disabled in the
+    # workers and replaced by one line per task printed here in task order.
+    worker_task_options = dict(task_options)
+    worker_task_options['silent'] = True
+
+    if task_options['copy_method'] == ARGCHO_COPY_METHOD_COPY:
+        # Worker processes are started lazily, after the task prefetch thread has started,
+        # so they are spawned rather than forked to not inherit locks held by that thread.
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_task_worker, initargs=(worker_task_options, None, True)
+        )
+    else:
+        init_task_worker(worker_task_options, metrics)
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    verbose = (not task_options['silent'])
+    task_status_count = {status: 0 for status in TASK_STATUS_LIST}
+    failed_task_list = []
+
+    with executor:
+        max_inflight = num_workers * WORKER_INFLIGHT_TASKS_PER_WORKER
+        for task_num, (task, task_result) in enumerate(
+                iter_bounded_results(executor, perform_task_in_worker, task_list, max_inflight)):
+            task_srcpath, task_dstpath = task
+            task_status, task_error_trace, metrics_snapshot, stat_cache_counts = task_result
+            if metrics_snapshot is not None:
+                metrics.merge(metrics_snapshot)
+            if stat_cache_counts is not None:
+                PATH_STAT_CACHE.merge_counts(stat_cache_counts)
+            task_status_count[task_status] += 1
+            if task_status == TASK_STATUS_FAILED:
+                failed_task_list.append(task)
+                sys.stderr.write("Task {} {}: {} --> {}\n{}".format(
+                    task_num+1, task_status.upper(), task_srcpath, task_dstpath, task_error_trace))
+            elif verbose:
+                print("Task {} {}{}: {} --> {}".format(
+                    task_num+1, task_status.upper(), " (dryrun)"*task_options['dryrun'], task_srcpath, task_dstpath))
+            if journal is not None and task_status == TASK_STATUS_SUCCESS:
+                journal.record(task)
+
+    if verbose:
+        print("Task summary ({} workers): {}".format(
+            num_workers, ', '.join(["{} {}".format(task_status_count[status], status) for status in TASK_STATUS_LIST])
+        ))
+
+    if len(failed_task_list) > 0:
+        raise TaskFailureError("{} of {} tasks failed:\n{}".format(
+            len(failed_task_list), sum(task_status_count.values()),
+            '\n'.join(["{} --> {}".format(src, dst) for src, dst in failed_task_list])
+        ))
 
 
 def adjust_dst_path(src_path, dst_path, dst_can_be_file=False, dst_path_type=PATH_TYPE_UNKNOWN,
                     sync_mode_default=ARGMOD_SYNC_MODE_NULL):
     global SYNC_MODE_GLOBAL
 
-    if dst_path_type == PATH_TYPE_DIR or (dst_path_type == PATH_TYPE_UNKNOWN and os.path.isdir(dst_path)):
-        if os.path.isfile(src_path):
+    if dst_path_type == PATH_TYPE_DIR or (dst_path_type == PATH_TYPE_UNKNOWN and PATH_STAT_CACHE.isdir(dst_path)):
+        if PATH_STAT_CACHE.isfile(src_path):
             dst_path = os.path.join(dst_path, os.path.basename(src_path))
         else:
             # src_path is a directory
@@ -711,8 +2119,8 @@ def adjust_dst_path(src_path, dst_path, dst_can_be_file=False, dst_path_type=PAT
             if not su.endswith_one_of_coll(dst_path, PATH_SEPARATORS_LIST):
                 dst_path = dst_path+os.path.sep
 
-    elif dst_path_type == PATH_TYPE_FILE or (dst_path_type == PATH_TYPE_UNKNOWN and os.path.isfile(dst_path)):
-        if os.path.isdir(src_path):
+    elif dst_path_type == PATH_TYPE_FILE or (dst_path_type == PATH_TYPE_UNKNOWN and PATH_STAT_CACHE.isfile(dst_path)):
+        if PATH_STAT_CACHE.isdir(src_path):
             raise su.ScriptArgumentError(
                 "source directory ({}) cannot overwrite existing destination file ({})".format(src_path, dst_path)
             )
@@ -722,7 +2130,7 @@ def adjust_dst_path(src_path, dst_path, dst_can_be_file=False, dst_path_type=PAT
 
     else:
         # dst_path does not yet exist
-        if os.path.isfile(src_path):
+        if PATH_STAT_CACHE.isfile(src_path):
             if dst_can_be_file and not su.endswith_one_of_coll(dst_path, PATH_SEPARATORS_LIST):
                 # dst_path will be the exact path of the file copy
                 pass
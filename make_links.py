@@ -3,13 +3,28 @@
 # Erik Husby, 2018
 
 
+from __future__ import print_function
 import argparse
+import bisect
+import collections
+import errno
 import filecmp
+import fnmatch
 import glob
 import os
 import platform
+import re
 import subprocess
 import sys
+import threading
+try:
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+except ImportError:
+    ThreadPoolExecutor = None
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 global ARGV
@@ -24,7 +39,27 @@ LINK_TYPE_HARDLINK = 0
 LINK_TYPE_SYMLINK = 1
 DRYRUN = False
 SILENT = False
-CMD_RAW = None
+DEBUG = False
+LINKER = None
+DIR_CACHE = None
+EXTERNAL_LINK_BATCH_SIZE = 1000
+WINDOWS_CMD_MAX_CHARS = 8000
+FLIST_INFLIGHT_LINES_PER_THREAD = 16
+LISTING_INDEX = None
+LISTING_INDEX_MAX_DIRS = 4096
+GLOB_MAGIC_CHECK = re.compile(r'[*?[]')
+PLAN_WRITER = None
+PLAN_HEADER_PREFIX = '# make_links plan v1 '
+PLAN_LINK_TYPE_NAMES = {LINK_TYPE_HARDLINK: 'hardlink', LINK_TYPE_SYMLINK: 'symlink'}
+PLAN_DELIM = '\t'
+try:
+    LIST_FUNCTION = os.scandir
+except AttributeError:
+    LIST_FUNCTION = os.listdir
+FNAME_CONTAINS_REGEX = None
+DNAME_CONTAINS_REGEX = None
+EXCLUDE_TRIE = None
+PRINT_LOCK = threading.Lock()
 ###########################
 
 
@@ -46,7 +81,9 @@ DEPTH_LIMIT = 'inf'
 TRANSPLANT_TREE = False
 COLLAPSE_TREE = False
 OVERWRITE = False
+COMPARE_CONTENT = False
 LINK_TYPE = LINK_TYPE_HARDLINK
+THREADS = 1
 ##############################
 
 
@@ -67,12 +104,12 @@ EXCLUDE_FPATHS = [
 ############################
 
 EXCLUDE_DNAMES, EXCLUDE_FNAMES = [
-    exclude_names if exclude_names != [''] else None for exclude_names in (
+    frozenset(exclude_names) if exclude_names != [''] else None for exclude_names in (
         EXCLUDE_DNAMES, EXCLUDE_FNAMES,
     )
 ]
 EXCLUDE_DPATHS, EXCLUDE_FPATHS = [
-    [os.path.abspath(os.path.expanduser(path)) for path in exclude_paths] if exclude_paths != [''] else None for exclude_paths in (
+    frozenset(os.path.abspath(os.path.expanduser(path)) for path in exclude_paths) if exclude_paths != [''] else None for exclude_paths in (
         EXCLUDE_DPATHS, EXCLUDE_FPATHS
     )
 ]
@@ -88,8 +125,11 @@ default_transplant_tree = TRANSPLANT_TREE
 default_collapse_tree = COLLAPSE_TREE
 default_flist_glob = FLIST_GLOB
 default_overwrite = OVERWRITE
+default_compare_content = COMPARE_CONTENT
+default_threads = THREADS
 default_dryrun = DRYRUN
 default_silent = SILENT
+default_debug = DEBUG
 
 default_fprefix = FNAME_PREFIX if FNAME_PREFIX is not None and FNAME_PREFIX != '' else None
 default_dprefix = DNAME_PREFIX if DNAME_PREFIX is not None and DNAME_PREFIX != '' else None
@@ -105,6 +145,10 @@ class SystemSupportError(Exception):
     def __init__(self, msg=""):
         super(Exception, self).__init__(msg)
 
+class PlanFileError(Exception):
+    def __init__(self, msg=""):
+        super(Exception, self).__init__(msg)
+
 
 def main():
     parser = argparse.ArgumentParser(description=(
@@ -216,18 +260,53 @@ def main():
               "*Only applies when `src` is a directory or a dir list.*".format(default_delim)
               +" (default={})".format(default_dreplace)*(default_dreplace is not None)))
 
+    parser.add_argument('--exclude-from', action='append', default=None,
+        help=("Path to a text file listing absolute source paths (one per line) to exclude. "
+              "An excluded directory path excludes its entire subtree, which is skipped "
+              "without being listed. Can be given multiple times."))
+
     parser.add_argument('--overwrite', action='store_true', default=default_overwrite,
         help=("If a file already exists at the path where the link is to be created "
-              "and it appears to `filecmp.cmp()` that the existing file is not already "
-              "a link to the source file, remove the existing file and create the link."
+              "and the existing file is not already a link to the source file, "
+              "remove the existing file and create the link."
               " (default={})".format(default_overwrite)))
 
+    parser.add_argument('--compare-content', action='store_true', default=default_compare_content,
+        help=("Decide whether an existing file at the path where the link is to be created "
+              "is already a correct link by comparing it with the source file using `filecmp.cmp()`, "
+              "which reads the contents of both files when their stat signatures differ. "
+              "By default, a hard link is correct if it has the same device and inode as the "
+              "source file, and a symbolic link is correct if its target is the source file path."
+              " (default={})".format(default_compare_content)))
+
+    parser.add_argument('--threads', type=int, default=default_threads,
+        help=("Number of threads used to traverse and link source directory trees, "
+              "with each subdirectory handed out to the next available thread. "
+              "If `src` is a file/dir list, this many threads also resolve file list "
+              "entries and link their files concurrently, with messages still "
+              "printed in file list order."
+              " (default={})".format(default_threads)))
+
+    parser.add_argument('--plan-out', default=None,
+        help=("Write the link operations that would be performed to this plan file "
+              "instead of creating links. Implies --dryrun. The plan file is a header "
+              "line followed by one 'SRC<tab>DST' line per link."))
+
+    parser.add_argument('--plan-in', default=None,
+        help=("Create the links listed in a plan file written with --plan-out, "
+              "skipping source traversal, filters and glob expansion. "
+              "`src`, `dst` and filter options are ignored, and the link type is "
+              "taken from the plan file."))
+
     parser.add_argument('--silent', action='store_true', default=default_silent,
         help="Do not print all actions.")
 
     parser.add_argument('--dryrun', action='store_true', default=default_dryrun,
         help="Print actions without executing.")
 
+    parser.add_argument('--debug', action='store_true', default=default_debug,
+        help="Print directory cache and listing index statistics at the end of the run.")
+
     system_choices = ('Windows', 'Linux')
     system = platform.system()
     python_version = platform.python_version()
@@ -240,14 +319,40 @@ def main():
     global FLIST_PREFIX, FLIST_CONTAINS, FLIST_SUFFIX
     global FNAME_PREFIX, FNAME_CONTAINS, FNAME_SUFFIX, FNAME_REPLACE
     global DNAME_PREFIX, DNAME_CONTAINS, DNAME_SUFFIX, DNAME_REPLACE
-    global DEPTH_LIMIT, COLLAPSE_TREE, TRANSPLANT_TREE
-    global CMD_RAW, LINK_FUNCTION, OVERWRITE, DRYRUN, VERBOSE
-    global ARGV, DELIM
+    global FNAME_CONTAINS_REGEX, DNAME_CONTAINS_REGEX, EXCLUDE_TRIE, LISTING_INDEX
+    global DEPTH_LIMIT, COLLAPSE_TREE, TRANSPLANT_TREE, THREADS
+    global LINKER, LINK_TYPE, OVERWRITE, COMPARE_CONTENT, DRYRUN, VERBOSE, DEBUG, DIR_CACHE
+    global ARGV, DELIM, PLAN_WRITER
 
     ARGV = sys.argv
 
     # Parse arguments.
     args = parser.parse_args()
+
+    if args.plan_in is not None:
+        if args.plan_out is not None:
+            parser.error("--plan-in and --plan-out options are mutually exclusive")
+        if not os.path.isfile(args.plan_in):
+            parser.error("--plan-in file does not exist: {}".format(args.plan_in))
+        try:
+            LINK_TYPE = read_plan_link_type(args.plan_in)
+        except PlanFileError as e:
+            parser.error(str(e))
+        args.hardlink = (LINK_TYPE == LINK_TYPE_HARDLINK)
+        args.symlink = (LINK_TYPE == LINK_TYPE_SYMLINK)
+        OVERWRITE = args.overwrite
+        COMPARE_CONTENT = args.compare_content
+        DRYRUN = args.dryrun
+        VERBOSE = (not args.silent)
+        DEBUG = args.debug
+        LINKER = get_linker(system, python_version, args)
+        DIR_CACHE = DirectoryCache(dryrun=DRYRUN)
+        replay_plan(args.plan_in)
+        LINKER.flush()
+        if DEBUG:
+            print(DIR_CACHE.report())
+        return
+
     if args.src is None or args.dst is None:
         parser.error("`src` and `dst` must both be specified")
     SRC = os.path.abspath(os.path.expanduser(args.src))
@@ -275,8 +380,11 @@ def main():
     else:
         parser.error("`depth` must be 'inf' (sans quotes) or a positive integer")
     OVERWRITE = args.overwrite
+    COMPARE_CONTENT = args.compare_content
     DRYRUN = args.dryrun
+    THREADS = args.threads
     VERBOSE = (not args.silent)
+    DEBUG = args.debug
 
     if FNAME_PREFIX is not None and '>' in FNAME_PREFIX[0]:
         FLIST_PREFIX, FNAME_PREFIX[0] = FNAME_PREFIX[0].split('>')
@@ -313,6 +421,19 @@ def main():
                 parser.error("--dreplace argument must contain '>'")
             DNAME_REPLACE[i] = repl_str.split('>')
 
+    # Compile name filters so that each directory entry is tested with a single
+    # str.startswith/str.endswith call and a single regex search.
+    FNAME_PREFIX, DNAME_PREFIX, FNAME_SUFFIX, DNAME_SUFFIX = [
+        tuple(name_filter) if name_filter is not None else None for name_filter in (
+            FNAME_PREFIX, DNAME_PREFIX, FNAME_SUFFIX, DNAME_SUFFIX
+        )
+    ]
+    FNAME_CONTAINS_REGEX, DNAME_CONTAINS_REGEX = [
+        compile_contains_regex(name_filter) for name_filter in (
+            FNAME_CONTAINS, DNAME_CONTAINS
+        )
+    ]
+
     # Validate arguments.
     if os.path.isdir(SRC):
         if [flist_arg is not None for flist_arg in (FLIST_PREFIX, FLIST_CONTAINS, FLIST_SUFFIX)].count(True) > 0:
@@ -330,131 +451,684 @@ def main():
         parser.error("One of --hardlink and --symlink options must be specified")
     if args.hardlink and args.symlink:
         parser.error("--hardlink and --symlink options are mutually exclusive")
+    if THREADS < 1:
+        parser.error("--threads must be a positive integer")
+    if THREADS > 1 and ThreadPoolExecutor is None:
+        parser.error("--threads option requires Python's concurrent.futures module "
+                     "(Python version {})".format(python_version))
+    if args.exclude_from is not None:
+        for exclude_file in args.exclude_from:
+            if not os.path.isfile(exclude_file):
+                parser.error("--exclude-from file does not exist: {}".format(exclude_file))
+        EXCLUDE_TRIE = PathTrie()
+        for exclude_file in args.exclude_from:
+            EXCLUDE_TRIE.add_from_file(exclude_file)
+        if VERBOSE:
+            print("Loaded {} exclusion paths from --exclude-from".format(len(EXCLUDE_TRIE)))
+
+    LINK_TYPE = LINK_TYPE_HARDLINK if args.hardlink else LINK_TYPE_SYMLINK
+    # Select the linking backend once, so that linking each file is a direct call.
+    LINKER = get_linker(system, python_version, args)
+
+    if args.plan_out is not None:
+        DRYRUN = True
+        PLAN_WRITER = PlanWriter(args.plan_out, LINK_TYPE)
+
+    DIR_CACHE = DirectoryCache(dryrun=DRYRUN)
+    DIR_CACHE.ensure(DSTDIR)
 
-    LINK_FUNCTION = None
     try:
-        if args.hardlink:
-            LINK_FUNCTION = os.link
-        elif args.symlink:
-            LINK_FUNCTION = os.symlink
-    except AttributeError:
-        print("Python built-in link function is not available "
-              "on this system ({}) and/or Python version ({})".format(system, python_version))
-        print("Falling back to external calls to system-level link command")
-    # Set syntax of linking command, to be evaluated before execution.
-    CMD_RAW = get_cmd(system, args)
+        if os.path.isdir(SRC):
+            if TRANSPLANT_TREE:
+                link_rootdir_name = os.path.basename(os.path.abspath(SRC))
+                if DNAME_REPLACE is not None:
+                    for repl_item in DNAME_REPLACE:
+                        link_rootdir_name = link_rootdir_name.replace(repl_item[0], repl_item[1])
+                link_rootdir = os.path.join(DSTDIR, link_rootdir_name)
+                DIR_CACHE.ensure(link_rootdir)
+                DSTDIR = link_rootdir
+            link_dir(SRC, DSTDIR, 0)
+
+        elif os.path.isfile(SRC):
+            if LIST_FUNCTION is not os.listdir:
+                LISTING_INDEX = DirListingIndex()
+            link_flist(SRC, DSTDIR)
+
+        LINKER.flush()
+    except BaseException:
+        if PLAN_WRITER is not None:
+            PLAN_WRITER.discard()
+        raise
+
+    if PLAN_WRITER is not None:
+        PLAN_WRITER.close()
+        print("Wrote {} link operations to plan file: {}".format(PLAN_WRITER.num_ops, PLAN_WRITER.plan_file))
+
+    if DEBUG:
+        print(DIR_CACHE.report())
+        if LISTING_INDEX is not None:
+            print(LISTING_INDEX.report())
+
+
+class DirectoryCache(object):
+    """Creates destination directories, remembering which already exist.
+
+    A directory that has been seen to exist (or was created) during this run
+    is never checked again, and missing ancestors of a directory are created
+    top-down in a single pass from the nearest existing ancestor.
+    Safe to share between threads; counts may be approximate in that case.
+    """
+
+    def __init__(self, dryrun=False):
+        self.dryrun = dryrun
+        self.known_dirs = set()
+        self.num_calls = 0
+        self.num_hits = 0
+        self.num_stat = 0
+        self.num_mkdir = 0
+
+    def ensure(self, dirpath):
+        """Make sure `dirpath` exists. Returns False if this was known without filesystem access."""
+        self.num_calls += 1
+        dirpath = os.path.normpath(dirpath)
+        if dirpath in self.known_dirs:
+            self.num_hits += 1
+            return False
+
+        missing_dirs = []
+        ancestor = dirpath
+        while ancestor not in self.known_dirs:
+            self.num_stat += 1
+            if os.path.isdir(ancestor):
+                self.known_dirs.add(ancestor)
+                break
+            missing_dirs.append(ancestor)
+            parent = os.path.dirname(ancestor)
+            if parent == ancestor or parent == '':
+                break
+            ancestor = parent
+
+        for missing_dir in reversed(missing_dirs):
+            if not self.dryrun:
+                self.num_mkdir += 1
+                try:
+                    os.mkdir(missing_dir)
+                except OSError:
+                    # Directory may have been created concurrently
+                    if not os.path.isdir(missing_dir):
+                        raise
+            self.known_dirs.add(missing_dir)
+
+        return True
+
+    def report(self):
+        return ("Directory cache: {} directory checks, {} answered from cache, "
+                "{} stat calls, {} mkdir calls").format(
+            self.num_calls, self.num_hits, self.num_stat, self.num_mkdir)
+
+
+class PathTrie(object):
+    """Set of path prefixes stored by path component.
+
+    A path matches if it, or any of its ancestor directories, was added, so
+    a lookup costs O(path depth) regardless of the number of stored paths.
+    """
+
+    # Key marking a node at which an added path ends; never a path component.
+    _END = None
+
+    def __init__(self):
+        self.root = {}
+        self.num_paths = 0
+
+    def __len__(self):
+        return self.num_paths
+
+    @staticmethod
+    def _split(path):
+        return os.path.normpath(os.path.abspath(os.path.expanduser(path))).split(os.sep)
+
+    def add(self, path):
+        node = self.root
+        for component in self._split(path):
+            node = node.setdefault(component, {})
+        if PathTrie._END not in node:
+            node[PathTrie._END] = True
+            self.num_paths += 1
+
+    def add_from_file(self, path_list_file):
+        with open(path_list_file, 'r') as path_list_fp:
+            for line in path_list_fp:
+                path = line.strip()
+                if path != '':
+                    self.add(path)
+
+    def matches(self, path):
+        node = self.root
+        for component in self._split(path):
+            node = node.get(component)
+            if node is None:
+                return False
+            if PathTrie._END in node:
+                return True
+        return False
+
+
+class DirListingIndex(object):
+    """Answers file existence and glob queries from cached directory listings.
+
+    Each directory is listed once with `os.scandir` and its file and
+    subdirectory names are kept in memory, so checking all components of
+    many source files in the same directory costs a single listing.
+    Names are also kept sorted, so a glob only tests the names that share
+    its literal prefix. Names are compared in `os.path.normcase` form, so
+    matching is case-insensitive where the system is (as with `glob.glob`).
+    The least recently used listings are evicted beyond `max_dirs`.
+    """
+
+    def __init__(self, max_dirs=LISTING_INDEX_MAX_DIRS):
+        self.max_dirs = max_dirs
+        self.listings = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.num_lookups = 0
+        self.num_listings = 0
+
+    def _listing(self, dirpath):
+        # Returns (sorted (normcase name, listing position, name) tuples,
+        # normcase file names, normcase subdirectory names),
+        # or None if the directory cannot be listed.
+        with self.lock:
+            self.num_lookups += 1
+            listing = self.listings.get(dirpath, False)
+            if listing is not False:
+                self.listings.move_to_end(dirpath)
+                return listing
+        try:
+            names, fnames, dnames = [], set(), set()
+            for dirent in LIST_FUNCTION(dirpath):
+                names.append(dirent.name)
+                if dirent.is_dir():
+                    dnames.add(os.path.normcase(dirent.name))
+                elif dirent.is_file():
+                    fnames.add(os.path.normcase(dirent.name))
+            listing = (
+                sorted((os.path.normcase(name), i, name) for i, name in enumerate(names)),
+                frozenset(fnames), frozenset(dnames)
+            )
+        except OSError:
+            listing = None
+        with self.lock:
+            self.num_listings += 1
+            self.listings[dirpath] = listing
+            if len(self.listings) > self.max_dirs:
+                self.listings.popitem(last=False)
+        return listing
+
+    def isfile(self, path):
+        dirpath, name = os.path.split(path)
+        listing = self._listing(dirpath)
+        if listing is None:
+            return os.path.isfile(path)
+        return os.path.normcase(name) in listing[1]
+
+    def isdir(self, path):
+        dirpath, name = os.path.split(os.path.normpath(path))
+        listing = self._listing(dirpath)
+        if listing is None or name == '':
+            return os.path.isdir(path)
+        return os.path.normcase(name) in listing[2]
+
+    def glob(self, pattern):
+        # Same matches as `glob.glob`, provided wildcards are only used
+        # in the last path component.
+        dirpath, name_pattern = os.path.split(pattern)
+        if glob.has_magic(dirpath) or name_pattern == '':
+            return glob.glob(pattern)
+        listing = self._listing(dirpath)
+        if listing is None:
+            return glob.glob(pattern)
+        sorted_names = listing[0]
+
+        # Normalize case the same way `fnmatch.filter` does
+        name_pattern_key = os.path.normcase(name_pattern)
+        literal_prefix = GLOB_MAGIC_CHECK.split(name_pattern_key, 1)[0]
+        matches = []
+        i = bisect.bisect_left(sorted_names, (literal_prefix,))
+        while i < len(sorted_names) and sorted_names[i][0].startswith(literal_prefix):
+            matches.append(sorted_names[i])
+            i += 1
+        if not glob.has_magic(name_pattern):
+            return [pattern] if matches and matches[0][0] == name_pattern_key else []
+        if not name_pattern.startswith('.'):
+            matches = [m for m in matches if not m[2].startswith('.')]
+
+        # Return matches in listing order, like `glob.glob`.
+        match_regex = re.compile(fnmatch.translate(name_pattern_key))
+        return [os.path.join(dirpath, m[2]) for m in sorted(
+            (m for m in matches if match_regex.match(m[0])), key=lambda m: m[1])]
+
+    def report(self):
+        return "Directory listing index: {} lookups, {} directory listings".format(
+            self.num_lookups, self.num_listings)
+
+
+class PlanWriter(object):
+    """Records link operations to a plan file for later replay with --plan-in.
+
+    The plan is written to a temporary file next to `plan_file`, which is renamed
+    into place by `close` only once the whole traversal has succeeded, so that a
+    run that fails partway never leaves a truncated plan to be replayed.
+    """
+
+    def __init__(self, plan_file, link_type):
+        self.plan_file = plan_file
+        self.tmp_plan_file = "{}.partial-{}".format(plan_file, os.getpid())
+        self.plan_fp = open(self.tmp_plan_file, 'w')
+        self.plan_fp.write(PLAN_HEADER_PREFIX + PLAN_LINK_TYPE_NAMES[link_type] + '\n')
+        self.lock = threading.Lock()
+        self.num_ops = 0
+
+    def add(self, src_file, dst_file):
+        for path in (src_file, dst_file):
+            if PLAN_DELIM in path or '\n' in path:
+                raise PlanFileError("Path cannot be written to plan file "
+                                    "because it contains a tab or newline: {!r}".format(path))
+        with self.lock:
+            self.plan_fp.write(src_file + PLAN_DELIM + dst_file + '\n')
+            self.num_ops += 1
+
+    def close(self):
+        self.plan_fp.close()
+        if hasattr(os, 'replace'):
+            os.replace(self.tmp_plan_file, self.plan_file)
+        else:
+            if os.path.exists(self.plan_file):
+                os.remove(self.plan_file)
+            os.rename(self.tmp_plan_file, self.plan_file)
+
+    def discard(self):
+        self.plan_fp.close()
+        if os.path.isfile(self.tmp_plan_file):
+            os.remove(self.tmp_plan_file)
+
+
+def read_plan_link_type(plan_file):
+    with open(plan_file, 'r') as plan_fp:
+        header = plan_fp.readline().rstrip('\n')
+    for link_type, link_type_name in PLAN_LINK_TYPE_NAMES.items():
+        if header == PLAN_HEADER_PREFIX + link_type_name:
+            return link_type
+    raise PlanFileError("Not a make_links plan file: {}".format(plan_file))
+
+
+def replay_plan(plan_file):
+    # Links are created with direct calls to the built-in link function;
+    # only destinations that already exist go through the checks in link_file.
+    direct_link = LINKER.link if isinstance(LINKER, BuiltinLinker) and not DRYRUN else None
+
+    with open(plan_file, 'r') as plan_fp:
+        plan_fp.readline()
+        for line_num, line in enumerate(plan_fp, 2):
+            try:
+                src_file, dst_file = line.rstrip('\n').split(PLAN_DELIM)
+            except ValueError:
+                raise PlanFileError("Invalid plan file line {}: {!r}".format(line_num, line))
+
+            DIR_CACHE.ensure(os.path.dirname(dst_file))
+
+            if direct_link is not None:
+                try:
+                    direct_link(src_file, dst_file)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                else:
+                    if VERBOSE:
+                        print("LINKING: {} --> {}".format(src_file, dst_file))
+                    continue
 
-    if not os.path.isdir(DSTDIR) and not DRYRUN:
-        os.makedirs(DSTDIR)
+            link_file(src_file, dst_file)
 
-    if os.path.isdir(SRC):
-        if TRANSPLANT_TREE:
-            link_rootdir_name = os.path.basename(os.path.abspath(SRC))
-            if DNAME_REPLACE is not None:
-                for repl_item in DNAME_REPLACE:
-                    link_rootdir_name = link_rootdir_name.replace(repl_item[0], repl_item[1])
-            link_rootdir = os.path.join(DSTDIR, link_rootdir_name)
-            if not os.path.isdir(link_rootdir) and not DRYRUN:
-                os.makedirs(link_rootdir)
-            DSTDIR = link_rootdir
-        link_dir(SRC, DSTDIR, 0)
 
-    elif os.path.isfile(SRC):
-        link_flist(SRC, DSTDIR)
+class BuiltinLinker(object):
+    """Creates each link with a built-in Python link function (`os.link` or `os.symlink`)."""
 
+    def __init__(self, link_function):
+        self.link = link_function
 
-def get_cmd(systype, args):
-    cmd = None
+    def flush(self):
+        pass
 
-    if systype == 'Windows':
-        if args.hardlink:
-            cmd = r"r'mklink /h {0} {1}'.format(dst_file, src_file)"
-        elif args.symlink:
-            cmd = r"r'mklink {0} {1}'.format(dst_file, src_file)"
 
-    elif systype == 'Linux':
-        if args.hardlink:
-            cmd = r"r'ln {0} {1}'.format(src_file, dst_file)"
-        elif args.symlink:
-            cmd = r"r'ln -s {0} {1}'.format(src_file, dst_file)"
+class ExternalLinker(object):
+    """Creates links with the system-level link command, many links per subprocess call.
 
-    elif LINK_FUNCTION is not None:
+    Links are queued and created in batches. On Linux, links that keep the
+    source file name are grouped by destination directory into single
+    `ln -t DIR SRC...` calls; on Windows, `mklink` commands are chained in
+    one shell call up to the command line length limit.
+    """
+
+    def __init__(self, systype, symlink, batch_size=EXTERNAL_LINK_BATCH_SIZE):
+        self.systype = systype
+        self.symlink = symlink
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def link(self, src_file, dst_file):
+        with self.lock:
+            self.pending.append((src_file, dst_file))
+            if len(self.pending) < self.batch_size:
+                return
+            batch, self.pending = self.pending, []
+        self._link_batch(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self._link_batch(batch)
+
+    def _link_batch(self, batch):
+        if self.systype == 'Linux':
+            self._link_batch_linux(batch)
+        elif self.systype == 'Windows':
+            self._link_batch_windows(batch)
+
+    def _link_batch_linux(self, batch):
+        ln_cmd = ['ln', '-s'] if self.symlink else ['ln']
+        dstdir_srcfiles = {}
+        renamed_links = []
+        for src_file, dst_file in batch:
+            dstdir, dst_fname = os.path.split(dst_file)
+            if dst_fname == os.path.basename(src_file):
+                dstdir_srcfiles.setdefault(dstdir, []).append(src_file)
+            else:
+                renamed_links.append((src_file, dst_file))
+        for dstdir, src_files in dstdir_srcfiles.items():
+            subprocess.call(ln_cmd + ['-t', dstdir, '--'] + src_files)
+        for src_file, dst_file in renamed_links:
+            subprocess.call(ln_cmd + ['--', src_file, dst_file])
+
+    def _link_batch_windows(self, batch):
+        mklink_fmt = r'mklink "{}" "{}"' if self.symlink else r'mklink /h "{}" "{}"'
+        cmd_list = []
+        cmd_len = 0
+        for src_file, dst_file in batch:
+            cmd = mklink_fmt.format(dst_file, src_file)
+            if cmd_list and cmd_len + len(cmd) + 3 > WINDOWS_CMD_MAX_CHARS:
+                subprocess.call(' & '.join(cmd_list), shell=True)
+                cmd_list, cmd_len = [], 0
+            cmd_list.append(cmd)
+            cmd_len += len(cmd) + 3
+        if cmd_list:
+            subprocess.call(' & '.join(cmd_list), shell=True)
+
+
+def get_linker(systype, python_version, args):
+    link_function = None
+    try:
         if args.hardlink:
-            cmd = r"r'Linking using built-in function: os.link({0} {1})'.format(src_file, dst_file)"
+            link_function = os.link
         elif args.symlink:
-            cmd = r"r'Linking using built-in function: os.symlink({0} {1})'.format(src_file, dst_file)"
+            link_function = os.symlink
+    except AttributeError:
+        print("Python built-in link function is not available "
+              "on this system ({}) and/or Python version ({})".format(systype, python_version))
+        print("Falling back to external calls to system-level link command")
 
+    if link_function is not None:
+        return BuiltinLinker(link_function)
+    elif systype in ('Windows', 'Linux'):
+        return ExternalLinker(systype, args.symlink)
     else:
-        raise SystemSupportError("Detected system type '{}' is not supported")
+        raise SystemSupportError("Detected system type '{}' is not supported".format(systype))
+
+
+def is_correct_link(src_file, dst_file):
+    if COMPARE_CONTENT:
+        return filecmp.cmp(src_file, dst_file)
+    if LINK_TYPE == LINK_TYPE_SYMLINK:
+        return os.path.islink(dst_file) and os.readlink(dst_file) == src_file
+    src_stat = os.stat(src_file)
+    dst_stat = os.lstat(dst_file)
+    return src_stat.st_ino == dst_stat.st_ino and src_stat.st_dev == dst_stat.st_dev
 
-    return cmd
 
+def print_locked(msg):
+    # Link threads print whole lines one at a time, so their messages do not interleave.
+    with PRINT_LOCK:
+        print(msg)
 
-def link_file(src_file, dst_file):
-  
-    if os.path.isfile(dst_file):
-        if filecmp.cmp(src_file, dst_file):
-            if VERBOSE:
-                print("Correct link already exists: {}".format(dst_file))
+
+def link_file(src_file, dst_file, log=print_locked):
+
+    if os.path.lexists(dst_file) and not os.path.isdir(dst_file):
+        if not clear_existing_dst(src_file, dst_file, log):
             return
-        else:
-            if VERBOSE:
-                print("File already exists, but is not the correct link and will be {}: {}".format(
-                  "overwritten" if OVERWRITE else "skipped", dst_file))
-            if OVERWRITE:
-                os.remove(dst_file)
-            else:
+
+    if (DRYRUN and PLAN_WRITER is None) or VERBOSE:
+        log("LINKING: {} --> {}".format(src_file, dst_file))
+    if PLAN_WRITER is not None:
+        PLAN_WRITER.add(src_file, dst_file)
+    elif not DRYRUN:
+        while True:
+            try:
+                LINKER.link(src_file, dst_file)
                 return
+            except OSError as e:
+                # With multiple threads, another thread may have created the same
+                # destination since it was checked (e.g. same-named files with --collapse-tree)
+                if e.errno != errno.EEXIST:
+                    raise
+            if not clear_existing_dst(src_file, dst_file, log):
+                return
+
 
-    if LINK_FUNCTION is None or DRYRUN or VERBOSE:
-        cmd = eval(CMD_RAW)
-        if DRYRUN or VERBOSE:
-            # print(cmd)
-            print("LINKING: {} --> {}".format(src_file, dst_file))
+def clear_existing_dst(src_file, dst_file, log=print_locked):
+    # Return True if a link should still be created at the existing `dst_file`,
+    # which is then removed (only with --overwrite, and if it is not the correct link).
+    try:
+        correct_link = is_correct_link(src_file, dst_file)
+    except OSError as e:
+        # Already removed by another thread
+        if e.errno != errno.ENOENT:
+            raise
+        return True
+    if correct_link:
+        if VERBOSE:
+            log("Correct link already exists: {}".format(dst_file))
+        return False
+    if VERBOSE:
+        log("File already exists, but is not the correct link and will be {}: {}".format(
+          "overwritten" if OVERWRITE else "skipped", dst_file))
+    if not OVERWRITE:
+        return False
     if not DRYRUN:
-        if LINK_FUNCTION is not None:
-            LINK_FUNCTION(src_file, dst_file)
-        else:
-            subprocess.call(cmd, shell=True)
+        try:
+            os.remove(dst_file)
+        except OSError as e:
+            # Already removed by another thread
+            if e.errno != errno.ENOENT:
+                raise
+    return True
 
 
 def link_dir(srcdir, dstdir, depth):
+    if THREADS > 1:
+        link_dir_parallel(srcdir, dstdir, depth)
+    else:
+        for subdir_args in link_dir_level(srcdir, dstdir, depth):
+            link_dir(*subdir_args)
+
+
+def link_dir_parallel(srcdir, dstdir, depth):
+    # Every directory is a separate job, so idle threads pick up subdirectories
+    # discovered by any other thread as soon as they are listed.
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        pending = {executor.submit(link_dir_level, srcdir, dstdir, depth)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for subdir_args in future.result():
+                    pending.add(executor.submit(link_dir_level, *subdir_args))
+
+
+def compile_contains_regex(substrings):
+    # One alternation over all substrings scans a name once,
+    # instead of once per substring.
+    if substrings is None:
+        return None
+    return re.compile('|'.join(re.escape(substr) for substr in substrings))
+
+
+def iter_dir_entries(srcdir):
+    if LIST_FUNCTION is os.listdir:
+        for dirent in os.listdir(srcdir):
+            src_dirent = os.path.join(srcdir, dirent)
+            yield dirent, src_dirent, os.path.isdir(src_dirent)
+    else:
+        for dirent in LIST_FUNCTION(srcdir):
+            yield dirent.name, dirent.path, dirent.is_dir()
+
+
+def link_dir_level(srcdir, dstdir, depth):
+    # Link files directly within `srcdir`, and return the
+    # (srcdir, dstdir, depth) arguments of subdirectories to traverse.
+    subdir_args_list = []
 
-    for dirent in os.listdir(srcdir):
-        src_dirent = os.path.join(srcdir, dirent)
+    for dirent, src_dirent, dirent_is_dir in iter_dir_entries(srcdir):
 
-        name_replacements = DNAME_REPLACE if os.path.isdir(src_dirent) else FNAME_REPLACE
+        name_replacements = DNAME_REPLACE if dirent_is_dir else FNAME_REPLACE
         dst_dirent_name = dirent
         if name_replacements is not None:
             for repl_item in name_replacements:
                 dst_dirent_name = dst_dirent_name.replace(repl_item[0], repl_item[1])
         dst_dirent = os.path.join(dstdir, dst_dirent_name)
 
-        if os.path.isdir(src_dirent):
+        if dirent_is_dir:
             if (    depth < DEPTH_LIMIT
                 and (EXCLUDE_DNAMES is None or dirent not in EXCLUDE_DNAMES)
                 and (EXCLUDE_DPATHS is None or src_dirent not in EXCLUDE_DPATHS)
-                and (DNAME_PREFIX is None or True in (dirent.startswith(dp) for dp in DNAME_PREFIX))
-                and (DNAME_CONTAINS is None or True in (dc in dirent for dc in DNAME_CONTAINS))
-                and (DNAME_SUFFIX is None or True in (dirent.endswith(ds) for ds in DNAME_SUFFIX))):
+                and (EXCLUDE_TRIE is None or not EXCLUDE_TRIE.matches(src_dirent))
+                and (DNAME_PREFIX is None or dirent.startswith(DNAME_PREFIX))
+                and (DNAME_CONTAINS_REGEX is None or DNAME_CONTAINS_REGEX.search(dirent))
+                and (DNAME_SUFFIX is None or dirent.endswith(DNAME_SUFFIX))):
                 # The directory entry is a subdirectory to traverse.
                 if COLLAPSE_TREE:
                     dst_dirent = dstdir
-                elif not os.path.isdir(dst_dirent) and not DRYRUN:
-                    os.makedirs(dst_dirent)
-                link_dir(src_dirent, dst_dirent, depth+1)
+                else:
+                    DIR_CACHE.ensure(dst_dirent)
+                subdir_args_list.append((src_dirent, dst_dirent, depth+1))
 
         else:
             if (    (EXCLUDE_FNAMES is None or dirent not in EXCLUDE_FNAMES)
                 and (EXCLUDE_FPATHS is None or src_dirent not in EXCLUDE_FPATHS)
-                and (FNAME_PREFIX is None or True in (dirent.startswith(fp) for fp in FNAME_PREFIX))
-                and (FNAME_CONTAINS is None or True in (fc in dirent for fc in FNAME_CONTAINS))
-                and (FNAME_SUFFIX is None or True in (dirent.endswith(fs) for fs in FNAME_SUFFIX))):
+                and (EXCLUDE_TRIE is None or not EXCLUDE_TRIE.matches(src_dirent))
+                and (FNAME_PREFIX is None or dirent.startswith(FNAME_PREFIX))
+                and (FNAME_CONTAINS_REGEX is None or FNAME_CONTAINS_REGEX.search(dirent))
+                and (FNAME_SUFFIX is None or dirent.endswith(FNAME_SUFFIX))):
                 # The directory entry is a file to link.
                 link_file(src_dirent, dst_dirent)
 
+    return subdir_args_list
+
 
 def link_flist(flist, dstdir):
+    if THREADS > 1:
+        link_flist_parallel(flist, dstdir)
+        return
+
+    for line_num, txt_fpath, line_dstdir in iter_flist_entries(flist, dstdir):
+        src_dirs, src_files = resolve_flist_entry(line_num, txt_fpath)
+        if src_dirs:
+            link_flist_dirs(src_dirs, line_dstdir)
+        elif src_files:
+            link_flist_files(src_files, line_dstdir)
+
+
+def iter_prefetched(item_iter, maxsize):
+    """Yield the items of `item_iter`, consuming it ahead in a background thread.
+
+    At most `maxsize` items wait in a bounded queue, so producing items (such as
+    parsing a list file and resolving its paths) overlaps with the consumer's work
+    without reading the whole input into memory. An exception raised by
+    `item_iter` is re-raised to the consumer after the items produced before it.
+    """
+    item_queue = queue.Queue(maxsize=maxsize)
+    end_of_items = object()
+    producer_error = []
+
+    def produce():
+        try:
+            for item in item_iter:
+                item_queue.put(item)
+        except BaseException as e:
+            producer_error.append(e)
+        item_queue.put(end_of_items)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+
+    while True:
+        item = item_queue.get()
+        if item is end_of_items:
+            break
+        yield item
+
+    if len(producer_error) > 0:
+        raise producer_error[0]
+
+
+def link_flist_parallel(flist, dstdir):
+    # A reader thread parses the list while one pool resolves entries (glob and
+    # isfile checks) and a second pool links their files. Messages for each line
+    # are collected and printed in line order. Directory entries are linked in
+    # line order by this thread, since link_dir is itself parallel.
+    max_inflight = THREADS * FLIST_INFLIGHT_LINES_PER_THREAD
+    inflight = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=THREADS) as link_pool, \
+         ThreadPoolExecutor(max_workers=THREADS) as resolve_pool:
+
+        for line_num, txt_fpath, line_dstdir in iter_prefetched(iter_flist_entries(flist, dstdir), max_inflight):
+            line_messages = []
+            resolve_future = resolve_pool.submit(
+                resolve_and_link_flist_entry, link_pool,
+                line_num, txt_fpath, line_dstdir, line_messages.append
+            )
+            inflight.append((resolve_future, line_messages, line_dstdir))
+            if len(inflight) >= max_inflight:
+                finish_flist_entry(*inflight.popleft())
+
+        while inflight:
+            finish_flist_entry(*inflight.popleft())
+
+
+def resolve_and_link_flist_entry(link_pool, line_num, txt_fpath, dstdir, log):
+    # Hand the entry's files to the link pool as soon as they are resolved.
+    src_dirs, src_files = resolve_flist_entry(line_num, txt_fpath, log)
+    link_future = None
+    if not src_dirs and src_files:
+        link_future = link_pool.submit(link_flist_files, src_files, dstdir, log)
+    return src_dirs, link_future
+
+
+def finish_flist_entry(resolve_future, line_messages, dstdir):
+    src_dirs, link_future = resolve_future.result()
+    if link_future is not None:
+        link_future.result()
+    for msg in line_messages:
+        print(msg)
+    if src_dirs:
+        link_flist_dirs(src_dirs, dstdir)
+
+
+def iter_flist_entries(flist, dstdir):
+    # Yield (line_num, source path, destination directory) for each entry.
+    # A destination directory given on a line also applies to the lines after it.
     dstdir_orig = dstdir
 
     with open(flist, 'r') as flist_fp:
@@ -475,132 +1149,165 @@ def link_flist(flist, dstdir):
                 if not txt_fpath.startswith(FLIST_SRCDIR):
                     txt_fpath = os.path.join(FLIST_SRCDIR, txt_fpath)
 
-            txt_dpath, txt_fname = os.path.split(txt_fpath)
-            txt_dname = os.path.basename(txt_dpath)
+            yield line_num, txt_fpath, dstdir
 
-            if (    (EXCLUDE_DNAMES is None or txt_dname not in EXCLUDE_DNAMES)
-                and (EXCLUDE_DPATHS is None or txt_dpath not in EXCLUDE_DPATHS)
-                and (DNAME_PREFIX is None or True in (txt_dname.startswith(dp) for dp in DNAME_PREFIX))
-                and (DNAME_CONTAINS is None or True in (dc in txt_dname for dc in DNAME_CONTAINS))
-                and (DNAME_SUFFIX is None or True in (txt_dname.endswith(ds) for ds in DNAME_SUFFIX))):
-                pass
-            else:
-                continue
 
-            if txt_fname == '':
-                src_dirs = [txt_dpath]
-                if FLIST_GLOB:
-                    src_dirs_glob = []
-                    for dir_pattern in src_dirs:
-                        src_dirs_glob.extend([d for d in glob.glob(dir_pattern) if os.path.isdir(d)])
-                    src_dirs = src_dirs_glob
-                    if EXCLUDE_DPATHS is not None:
-                        src_dirs = [d for d in src_dirs if d not in EXCLUDE_DPATHS]
-                    if not src_dirs_glob:
-                        print("Glob for directory path pattern '{}' returned 0 matching directories".format(dir_pattern))
-                for d in src_dirs:
-                    # argv_dir = list(ARGV)
-                    # argv_dir[argv_dir.index('--src') + 1] = d
-                    # argv_dir[argv_dir.index('--dst') + 1] = dstdir
-                    # if '--transplant-tree' not in argv_dir:
-                    #     argv_dir.append('--transplant-tree')
-                    # cmd = '{} {}'.format(PYTHON_EXE, ' '.join(argv_dir)) if argv_dir[0].endswith('.py') else ' '.join(argv_dir)
-                    # if DRYRUN:
-                    #     print(cmd)
-                    # subprocess.call(cmd, shell=True)
-                    if not os.path.isdir(d):
-                        print("Source file list line {}: "
-                          "Missing source directory '{}', skipping".format(line_num+1, d))
-                        continue
-                    if TRANSPLANT_TREE:
-                        link_rootdir_name = os.path.basename(os.path.normpath(os.path.abspath(d)))
-                        if DNAME_REPLACE is not None:
-                            for repl_item in DNAME_REPLACE:
-                                link_rootdir_name = link_rootdir_name.replace(repl_item[0], repl_item[1])
-                        link_rootdir = os.path.join(dstdir, link_rootdir_name)
-                        if not os.path.isdir(link_rootdir) and not DRYRUN:
-                            os.makedirs(link_rootdir)
-                    else:
-                        link_rootdir = dstdir
-                    link_dir(d, link_rootdir, 0)
+def resolve_flist_entry(line_num, txt_fpath, log=print):
+    # Return (source directories, source files) to link for one file list entry.
+    txt_dpath, txt_fname = os.path.split(txt_fpath)
+    txt_dname = os.path.basename(txt_dpath)
+
+    if (    (EXCLUDE_DNAMES is None or txt_dname not in EXCLUDE_DNAMES)
+        and (EXCLUDE_DPATHS is None or txt_dpath not in EXCLUDE_DPATHS)
+        and (EXCLUDE_TRIE is None or not EXCLUDE_TRIE.matches(txt_dpath))
+        and (DNAME_PREFIX is None or txt_dname.startswith(DNAME_PREFIX))
+        and (DNAME_CONTAINS_REGEX is None or DNAME_CONTAINS_REGEX.search(txt_dname))
+        and (DNAME_SUFFIX is None or txt_dname.endswith(DNAME_SUFFIX))):
+        pass
+    else:
+        return [], []
+
+    if txt_fname == '':
+        src_dirs = [txt_dpath]
+        if FLIST_GLOB:
+            src_dirs_glob = []
+            for dir_pattern in src_dirs:
+                src_dirs_glob.extend([d for d in flist_glob(dir_pattern) if flist_isdir(d)])
+            src_dirs = src_dirs_glob
+            if EXCLUDE_DPATHS is not None:
+                src_dirs = [d for d in src_dirs if d not in EXCLUDE_DPATHS]
+            if EXCLUDE_TRIE is not None:
+                src_dirs = [d for d in src_dirs if not EXCLUDE_TRIE.matches(d)]
+            if not src_dirs_glob:
+                log("Glob for directory path pattern '{}' returned 0 matching directories".format(dir_pattern))
+        src_dirs_found = []
+        for d in src_dirs:
+            if not flist_isdir(d):
+                log("Source file list line {}: "
+                  "Missing source directory '{}', skipping".format(line_num+1, d))
                 continue
+            src_dirs_found.append(d)
+        return src_dirs_found, []
+
+    if FLIST_PREFIX is not None:
+        repl_index = txt_fname.find(FLIST_PREFIX)
+        if repl_index == -1:
+            log("Could not find file name prefix '{}' "
+                  "in source file list line {}: {}".format(FLIST_PREFIX, line_num+1, txt_fpath))
+            return [], []
+        txt_fname_suff = txt_fname[repl_index+len(FLIST_PREFIX):]
+        if FNAME_PREFIX is not None:
+            src_fnames = [link_pref+txt_fname_suff for link_pref in FNAME_PREFIX]
+        else:
+            src_fnames = [txt_fname_suff]
+
+    elif FLIST_SUFFIX is not None:
+        repl_index = txt_fname.rfind(FLIST_SUFFIX)
+        if repl_index == -1:
+            log("Could not find file name suffix '{}' "
+                  "in source file list line {}: {}".format(FLIST_SUFFIX, line_num+1, txt_fpath))
+            return [], []
+        txt_fname_pref = txt_fname[:repl_index]
+        if FNAME_SUFFIX is not None:
+            src_fnames = [txt_fname_pref+link_suff for link_suff in FNAME_SUFFIX]
+        else:
+            src_fnames = [txt_fname_pref]
 
-            if FLIST_PREFIX is not None:
-                repl_index = txt_fname.find(FLIST_PREFIX)
-                if repl_index == -1:
-                    print("Could not find file name prefix '{}' "
-                          "in source file list line {}: {}".format(FLIST_PREFIX, line_num+1, txt_fpath))
-                    continue
-                txt_fname_suff = txt_fname[repl_index+len(FLIST_PREFIX):]
-                if FNAME_PREFIX is not None:
-                    src_fnames = [link_pref+txt_fname_suff for link_pref in FNAME_PREFIX]
-                else:
-                    src_fnames = [txt_fname_suff]
+    elif FLIST_CONTAINS is not None:
+        src_fnames = [txt_fname.replace(FLIST_CONTAINS, link_cont) for link_cont in FNAME_CONTAINS]
 
-            elif FLIST_SUFFIX is not None:
-                repl_index = txt_fname.rfind(FLIST_SUFFIX)
-                if repl_index == -1:
-                    print("Could not find file name suffix '{}' "
-                          "in source file list line {}: {}".format(FLIST_SUFFIX, line_num+1, txt_fpath))
-                    continue
-                txt_fname_pref = txt_fname[:repl_index]
-                if FNAME_SUFFIX is not None:
-                    src_fnames = [txt_fname_pref+link_suff for link_suff in FNAME_SUFFIX]
+    else:
+        src_fnames = [txt_fname]
+
+    if FLIST_GLOB or EXCLUDE_FPATHS is not None or EXCLUDE_TRIE is not None:
+        if FLIST_GLOB:
+            src_files = []
+            for file_pattern in [os.path.join(txt_dpath, GLOB_PREFIX+fname+GLOB_SUFFIX) for fname in src_fnames]:
+                src_files_glob = flist_glob(file_pattern)
+                if not src_files_glob:
+                    log("Glob for file path pattern '{}' returned 0 matching files".format(file_pattern))
                 else:
-                    src_fnames = [txt_fname_pref]
-
-            elif FLIST_CONTAINS is not None:
-                src_fnames = [txt_fname.replace(FLIST_CONTAINS, link_cont) for link_cont in FNAME_CONTAINS]
+                    src_files.extend(src_files_glob)
+        else:
+            src_files = [os.path.join(txt_dpath, fname) for fname in src_fnames]
+        if EXCLUDE_FPATHS is not None:
+            src_files = [f for f in src_files if f not in EXCLUDE_FPATHS]
+        if EXCLUDE_TRIE is not None:
+            src_files = [f for f in src_files if not EXCLUDE_TRIE.matches(f)]
+        src_fnames = [os.path.basename(f) for f in src_files]
+
+    src_files = [os.path.join(txt_dpath, src_fname) for src_fname in src_fnames if (
+            (EXCLUDE_FNAMES is None or src_fname not in EXCLUDE_FNAMES)
+        and (FNAME_PREFIX is None or FLIST_PREFIX is not None or src_fname.startswith(FNAME_PREFIX))
+        and (FNAME_CONTAINS_REGEX is None or FLIST_CONTAINS is not None or FNAME_CONTAINS_REGEX.search(src_fname))
+        and (FNAME_SUFFIX is None or FLIST_SUFFIX is not None or src_fname.endswith(FNAME_SUFFIX))
+    )]
+    if len(src_files) == 0:
+        return [], []
+
+    missing_component = False
+    for f in src_files:
+        if not flist_isfile(f):
+            missing_component = True
+            log("Source file list line {}: "
+                  "Missing source file component '{}'".format(line_num+1, f))
+    if missing_component:
+        log("Source file list line {}: "
+              "Skipping source file '{}' due to missing component".format(line_num+1, txt_fpath))
+        return [], []
+
+    return [], src_files
+
+
+def flist_isfile(path):
+    return LISTING_INDEX.isfile(path) if LISTING_INDEX is not None else os.path.isfile(path)
+
+
+def flist_isdir(path):
+    return LISTING_INDEX.isdir(path) if LISTING_INDEX is not None else os.path.isdir(path)
+
+
+def flist_glob(pattern):
+    return LISTING_INDEX.glob(pattern) if LISTING_INDEX is not None else glob.glob(pattern)
+
+
+def link_flist_dirs(src_dirs, dstdir):
+    for d in src_dirs:
+        # argv_dir = list(ARGV)
+        # argv_dir[argv_dir.index('--src') + 1] = d
+        # argv_dir[argv_dir.index('--dst') + 1] = dstdir
+        # if '--transplant-tree' not in argv_dir:
+        #     argv_dir.append('--transplant-tree')
+        # cmd = '{} {}'.format(PYTHON_EXE, ' '.join(argv_dir)) if argv_dir[0].endswith('.py') else ' '.join(argv_dir)
+        # if DRYRUN:
+        #     print(cmd)
+        # subprocess.call(cmd, shell=True)
+        if TRANSPLANT_TREE:
+            link_rootdir_name = os.path.basename(os.path.normpath(os.path.abspath(d)))
+            if DNAME_REPLACE is not None:
+                for repl_item in DNAME_REPLACE:
+                    link_rootdir_name = link_rootdir_name.replace(repl_item[0], repl_item[1])
+            link_rootdir = os.path.join(dstdir, link_rootdir_name)
+        else:
+            link_rootdir = dstdir
+        DIR_CACHE.ensure(link_rootdir)
+        link_dir(d, link_rootdir, 0)
 
-            else:
-                src_fnames = [txt_fname]
-
-            if FLIST_GLOB or EXCLUDE_FPATHS is not None:
-                if FLIST_GLOB:
-                    src_files = []
-                    for file_pattern in [os.path.join(txt_dpath, GLOB_PREFIX+fname+GLOB_SUFFIX) for fname in src_fnames]:
-                        src_files_glob = glob.glob(file_pattern)
-                        if not src_files_glob:
-                            print("Glob for file path pattern '{}' returned 0 matching files".format(file_pattern))
-                        else:
-                            src_files.extend(src_files_glob)
-                else:
-                    src_files = [os.path.join(txt_dpath, fname) for fname in src_fnames]
-                if EXCLUDE_FPATHS is not None:
-                    src_files = [f for f in src_files if f not in EXCLUDE_FPATHS]
-                src_fnames = [os.path.basename(f) for f in src_files]
-
-            src_files = [os.path.join(txt_dpath, src_fname) for src_fname in src_fnames if (
-                    (EXCLUDE_FNAMES is None or src_fname not in EXCLUDE_FNAMES)
-                and (FNAME_PREFIX is None or FLIST_PREFIX is not None or True in (src_fname.startswith(fp) for fp in FNAME_PREFIX))
-                and (FNAME_CONTAINS is None or FLIST_CONTAINS is not None or True in (fc in src_fname for fc in FNAME_CONTAINS))
-                and (FNAME_SUFFIX is None or FLIST_SUFFIX is not None or True in (src_fname.endswith(fs) for fs in FNAME_SUFFIX))
-            )]
-            if len(src_files) == 0:
-                continue
 
-            missing_component = False
-            for f in src_files:
-                if not os.path.isfile(f):
-                    missing_component = True
-                    print("Source file list line {}: "
-                          "Missing source file component '{}'".format(line_num+1, f))
-            if missing_component:
-                print("Source file list line {}: "
-                      "Skipping source file '{}' due to missing component".format(line_num+1, txt_fpath))
-                continue
+def link_flist_files(src_files, dstdir, log=print_locked):
+    DIR_CACHE.ensure(dstdir)
 
-            for src_dirent in src_files:
-                if not os.path.isfile(src_dirent):
-                    continue
+    for src_dirent in src_files:
+        if not flist_isfile(src_dirent):
+            continue
 
-                dst_dirent_name = os.path.basename(src_dirent)
-                if FNAME_REPLACE is not None:
-                    for repl_item in FNAME_REPLACE:
-                        dst_dirent_name = dst_dirent_name.replace(repl_item[0], repl_item[1])
-                dst_dirent = os.path.join(dstdir, dst_dirent_name)
+        dst_dirent_name = os.path.basename(src_dirent)
+        if FNAME_REPLACE is not None:
+            for repl_item in FNAME_REPLACE:
+                dst_dirent_name = dst_dirent_name.replace(repl_item[0], repl_item[1])
+        dst_dirent = os.path.join(dstdir, dst_dirent_name)
 
-                link_file(src_dirent, dst_dirent)
+        link_file(src_dirent, dst_dirent, log)
 
 
 
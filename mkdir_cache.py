@@ -0,0 +1,58 @@
+import os
+
+
+class DirectoryCache(object):
+    """Creates destination directories, remembering which already exist.
+
+    A directory that has been seen to exist (or was created) during this run
+    is never checked again, and missing ancestors of a directory are created
+    top-down in a single pass from the nearest existing ancestor.
+    Safe to share between threads; counts may be approximate in that case.
+    """
+
+    def __init__(self, dryrun=False):
+        self.dryrun = dryrun
+        self.known_dirs = set()
+        self.num_calls = 0
+        self.num_hits = 0
+        self.num_stat = 0
+        self.num_mkdir = 0
+
+    def ensure(self, dirpath):
+        """Make sure `dirpath` exists. Returns False if this was known without filesystem access."""
+        self.num_calls += 1
+        dirpath = os.path.normpath(dirpath)
+        if dirpath in self.known_dirs:
+            self.num_hits += 1
+            return False
+
+        missing_dirs = []
+        ancestor = dirpath
+        while ancestor not in self.known_dirs:
+            self.num_stat += 1
+            if os.path.isdir(ancestor):
+                self.known_dirs.add(ancestor)
+                break
+            missing_dirs.append(ancestor)
+            parent = os.path.dirname(ancestor)
+            if parent == ancestor or parent == '':
+                break
+            ancestor = parent
+
+        for missing_dir in reversed(missing_dirs):
+            if not self.dryrun:
+                self.num_mkdir += 1
+                try:
+                    os.mkdir(missing_dir)
+                except OSError:
+                    # Directory may have been created concurrently
+                    if not os.path.isdir(missing_dir):
+                        raise
+            self.known_dirs.add(missing_dir)
+
+        return True
+
+    def report(self):
+        return ("Directory cache: {} directory checks, {} answered from cache, "
+                "{} stat calls, {} mkdir calls").format(
+            self.num_calls, self.num_hits, self.num_stat, self.num_mkdir)
@@ -0,0 +1,39 @@
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def iter_prefetched(item_iter, maxsize):
+    """Yield the items of `item_iter`, consuming it ahead in a background thread.
+
+    At most `maxsize` items wait in a bounded queue, so producing items (such as
+    parsing a list file and resolving its paths) overlaps with the consumer's work
+    without reading the whole input into memory. An exception raised by
+    `item_iter` is re-raised to the consumer after the items produced before it.
+    """
+    item_queue = queue.Queue(maxsize=maxsize)
+    end_of_items = object()
+    producer_error = []
+
+    def produce():
+        try:
+            for item in item_iter:
+                item_queue.put(item)
+        except BaseException as e:
+            producer_error.append(e)
+        item_queue.put(end_of_items)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+
+    while True:
+        item = item_queue.get()
+        if item is end_of_items:
+            break
+        yield item
+
+    if len(producer_error) > 0:
+        raise producer_error[0]
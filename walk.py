@@ -1,43 +1,604 @@
 
+import argparse
+import fnmatch
 import os
+import re
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import time
+try:
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+except ImportError:
+    ThreadPoolExecutor = None
+
+try:
+    STRING_TYPES = basestring
+except NameError:
+    STRING_TYPES = str
 
 try:
     WALK_LIST_FUNCTION_DEFAULT = os.scandir
 except AttributeError:
     WALK_LIST_FUNCTION_DEFAULT = os.listdir
+PARALLEL_WALK_WORKERS_DEFAULT = 8
+PARALLEL_WALK_INFLIGHT_PER_WORKER = 4
+WALK_SNAPSHOT_COMMIT_INTERVAL = 1000
+WALK_SNAPSHOT_MTIME_MARGIN_NS = 2 * 10**9
+WALK_SNAPSHOT_FORMAT_VERSION = 1
+TREE_DIFF_ADDED = 'added'
+TREE_DIFF_REMOVED = 'removed'
+TREE_DIFF_CHANGED = 'changed'
 
 class InvalidArgumentError(Exception):
     def __init__(self, msg=""):
         super(Exception, self).__init__(msg)
 
-def walk(srcdir, mindepth=0, maxdepth=float('inf'), list_rootdname=False, list_function=WALK_LIST_FUNCTION_DEFAULT):
-    if not os.path.isdir(srcdir):
-        raise InvalidArgumentError("`srcdir` directory does not exist: {}".format(srcdir))
-    if mindepth < 0 or maxdepth < 0:
-        raise InvalidArgumentError("depth arguments must be >= 0")
-    srcdir = os.path.abspath(srcdir)
+class WalkEntry(object):
+    # Stand-in for `os.DirEntry` when directories are listed with `os.listdir`.
+    # The stat result from classifying the entry is kept, so it is never re-statted.
+    # Like `os.DirEntry`, type checks and `stat` follow symlinks.
+    __slots__ = ('name', 'path', '_stat', '_symlink')
+
+    def __init__(self, rootdir, name):
+        self.name = name
+        self.path = os.path.join(rootdir, name)
+        self._stat = None
+        self._symlink = False
+        try:
+            lstat = os.lstat(self.path)
+            if stat.S_ISLNK(lstat.st_mode):
+                self._symlink = True
+                self._stat = os.stat(self.path)
+            else:
+                self._stat = lstat
+        except OSError:
+            pass
+
+    def is_dir(self):
+        return self._stat is not None and stat.S_ISDIR(self._stat.st_mode)
+
+    def is_file(self):
+        return self._stat is not None and stat.S_ISREG(self._stat.st_mode)
+
+    def is_symlink(self):
+        return self._symlink
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            return os.lstat(self.path)
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def __repr__(self):
+        return '<WalkEntry {!r}>'.format(self.name)
+
+class WalkFilter(object):
+    # Directory and file filters applied while each directory is listed.
+    # Directories that fail the directory filters are left out of the listing and never opened;
+    # files that fail the file filters are left out of the listing.
+    # Name prefix/suffix/glob arguments may be a string or a sequence of alternatives,
+    # exclusion arguments are collections of absolute paths,
+    # and predicates are called with the full path of the entry.
+
+    def __init__(self,
+                 dname_prefix=None, dname_suffix=None, dname_glob=None, exclude_dpaths=None, dir_predicate=None,
+                 fname_prefix=None, fname_suffix=None, fname_glob=None, exclude_fpaths=None, file_predicate=None):
+        self.dname_prefix = _as_tuple(dname_prefix)
+        self.dname_suffix = _as_tuple(dname_suffix)
+        self.dname_regex = _compile_glob_regex(dname_glob)
+        self.exclude_dpaths = _as_path_set(exclude_dpaths)
+        self.dir_predicate = dir_predicate
+        self.fname_prefix = _as_tuple(fname_prefix)
+        self.fname_suffix = _as_tuple(fname_suffix)
+        self.fname_regex = _compile_glob_regex(fname_glob)
+        self.exclude_fpaths = _as_path_set(exclude_fpaths)
+        self.file_predicate = file_predicate
+
+    def include_dir(self, rootdir, dname):
+        return _include(rootdir, dname,
+                        self.dname_prefix, self.dname_suffix, self.dname_regex,
+                        self.exclude_dpaths, self.dir_predicate)
+
+    def include_file(self, rootdir, fname):
+        return _include(rootdir, fname,
+                        self.fname_prefix, self.fname_suffix, self.fname_regex,
+                        self.exclude_fpaths, self.file_predicate)
+
+def _as_tuple(strings):
+    if strings is None:
+        return None
+    return (strings,) if isinstance(strings, STRING_TYPES) else tuple(strings)
+
+def _as_path_set(paths):
+    if not paths:
+        return None
+    return frozenset(os.path.abspath(path) for path in paths)
+
+def _compile_glob_regex(patterns):
+    patterns = _as_tuple(patterns)
+    if patterns is None:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+
+def _include(rootdir, name, prefix, suffix, regex, exclude_paths, predicate):
+    if prefix is not None and not name.startswith(prefix):
+        return False
+    if suffix is not None and not name.endswith(suffix):
+        return False
+    if regex is not None and not regex.match(name):
+        return False
+    if exclude_paths is not None or predicate is not None:
+        path = os.path.join(rootdir, name)
+        if exclude_paths is not None and path in exclude_paths:
+            return False
+        if predicate is not None and not predicate(path):
+            return False
+    return True
+
+class WalkSnapshot(object):
+    # Persistent SQLite record of directory listings, keyed by absolute directory path.
+    # `walk(..., snapshot=...)` reuses a recorded listing while the directory's mtime is unchanged,
+    # so walking a mostly static tree costs one stat per directory instead of one listing.
+    # A listing is only trusted if the directory's mtime was older than the time of listing
+    # by a safety margin, since changes within the same mtime tick would otherwise go unnoticed.
+    # Retargeting a symlink does not change its parent directory's mtime, so symlinks are
+    # recorded as such and classified again (with a stat) each time a listing is reused.
+    # The snapshot format is recorded as the database's `user_version`; an existing database
+    # of another format (or one that is not a snapshot at all) is refused, never modified.
+    # Not safe to share between threads.
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        user_version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if user_version == 0:
+            num_tables = self.conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]
+            if num_tables != 0:
+                self.conn.close()
+                raise InvalidArgumentError("`db_path` is not a walk snapshot database: {}".format(db_path))
+            self.conn.execute(
+                "CREATE TABLE listings ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, listed_ns INTEGER NOT NULL, "
+                "entries TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self.conn.execute("PRAGMA user_version = {}".format(WALK_SNAPSHOT_FORMAT_VERSION))
+            self.conn.commit()
+        elif user_version != WALK_SNAPSHOT_FORMAT_VERSION:
+            self.conn.close()
+            raise InvalidArgumentError("`db_path` walk snapshot format version {} is not supported "
+                                       "(expected {}): {}".format(user_version, WALK_SNAPSHOT_FORMAT_VERSION, db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.num_reused = 0
+        self.num_listed = 0
+        self.num_uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def listdir(self, rootdir, list_function=WALK_LIST_FUNCTION_DEFAULT):
+        # Returns (dnames, fnames) of `rootdir`, from the snapshot if still valid.
+        # Entries are recorded (directories first, then files, each in listing order) as a type
+        # character followed by the name: 'd' (directory), 'f' (anything else) or 'l' (symlink, to either).
+        mtime_ns = _mtime_ns(os.stat(rootdir))
+        row = self.conn.execute(
+            "SELECT mtime_ns, listed_ns, entries FROM listings WHERE path = ?", (rootdir,)
+        ).fetchone()
+        if row is not None and row[0] == mtime_ns and mtime_ns < row[1] - WALK_SNAPSHOT_MTIME_MARGIN_NS:
+            self.num_reused += 1
+            dnames, fnames = [], []
+            for entry in _split_names(row[2]):
+                entry_type, name = entry[0], entry[1:]
+                if entry_type == 'l':
+                    is_dir = os.path.isdir(os.path.join(rootdir, name))
+                else:
+                    is_dir = (entry_type == 'd')
+                (dnames if is_dir else fnames).append(name)
+            return dnames, fnames
+
+        listed_ns = int(time.time() * 1e9)
+        dirs, files = _list_dir(rootdir, list_function, True)
+        self.num_listed += 1
+        dnames = [dirent.name for dirent in dirs]
+        fnames = [dirent.name for dirent in files]
+        if row is not None:
+            prev_dnames = [entry[1:] for entry in _split_names(row[2]) if entry[0] in 'dl']
+            for dname in set(prev_dnames).difference(dnames):
+                self._forget_tree(os.path.join(rootdir, dname))
+        entries = ['l' + dirent.name if dirent.is_symlink() else 'd' + dirent.name for dirent in dirs]
+        entries.extend('l' + dirent.name if dirent.is_symlink() else 'f' + dirent.name for dirent in files)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+            (rootdir, mtime_ns, listed_ns, '\0'.join(entries))
+        )
+        self.num_uncommitted += 1
+        if self.num_uncommitted >= WALK_SNAPSHOT_COMMIT_INTERVAL:
+            self.commit()
+        return dnames, fnames
+
+    def _forget_tree(self, dirpath):
+        # Paths under `dirpath` sort between `dirpath + sep` and the next character after sep.
+        self.conn.execute(
+            "DELETE FROM listings WHERE path = ? OR (path >= ? AND path < ?)",
+            (dirpath, dirpath + os.sep, dirpath + chr(ord(os.sep) + 1))
+        )
+
+    def commit(self):
+        self.conn.commit()
+        self.num_uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def report(self):
+        return "Walk snapshot {}: {} listings reused, {} directories listed".format(
+            self.db_path, self.num_reused, self.num_listed)
+
+def _mtime_ns(st):
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        return int(st.st_mtime * 1e9)
+
+def _split_names(names):
+    return names.split('\0') if names != '' else []
+
+def walk(srcdir, mindepth=0, maxdepth=float('inf'), list_rootdname=False, list_function=WALK_LIST_FUNCTION_DEFAULT,
+         walk_filter=None, snapshot=None):
+    # Yields (rootdir, dnames, fnames) in depth-first order.
+    # Removing names from `dnames` before resuming the generator prunes those subdirectories.
+    # If `walk_filter` (a `WalkFilter`) is given, it is applied to every listing below `srcdir`.
+    # If `snapshot` (a `WalkSnapshot`) is given, listings are reused from and recorded to it.
+    srcdir = _check_walk_args(srcdir, mindepth, maxdepth)
     if list_rootdname and mindepth == 0:
         updir = os.path.dirname(srcdir)
         srcdname = os.path.basename(srcdir)
         yield updir, [srcdname], []
-    for x in _walk(srcdir, 1, mindepth, maxdepth, list_function):
+    for x in _walk(srcdir, mindepth, maxdepth, list_function, False, walk_filter, snapshot):
+        yield x
+
+def walk_entries(srcdir, mindepth=0, maxdepth=float('inf'), list_function=WALK_LIST_FUNCTION_DEFAULT,
+                 walk_filter=None):
+    # Same as `walk`, but yields (rootdir, dir_entries, file_entries) where entries are
+    # `os.DirEntry` objects (or `WalkEntry` records) with cached type and stat information.
+    srcdir = _check_walk_args(srcdir, mindepth, maxdepth)
+    for x in _walk(srcdir, mindepth, maxdepth, list_function, True, walk_filter):
         yield x
 
-def _walk(rootdir, depth, mindepth, maxdepth, list_function):
-    if depth > maxdepth:
+def parallel_walk(srcdir, workers=PARALLEL_WALK_WORKERS_DEFAULT, mindepth=0, maxdepth=float('inf'),
+                  ordered=False, list_function=WALK_LIST_FUNCTION_DEFAULT, walk_filter=None):
+    # Same output as `walk`, with directories listed concurrently by `workers` threads.
+    # By default, directories are yielded as soon as they are listed, in no particular order.
+    # With `ordered=True`, they are yielded in the same depth-first order as `walk`.
+    # Subdirectories are only scheduled once their parent has been yielded,
+    # so pruning `dnames` in place works in both modes.
+    if ThreadPoolExecutor is None:
+        raise InvalidArgumentError("`parallel_walk` requires Python's concurrent.futures module")
+    if workers < 1:
+        raise InvalidArgumentError("`workers` must be >= 1")
+    srcdir = _check_walk_args(srcdir, mindepth, maxdepth)
+    if maxdepth < 1:
         return
-    dnames, fnames = [], []
-    for dirent in list_function(rootdir):
-        if list_function is os.listdir:
-            pname = dirent
-            dirent_is_dir = os.path.isdir(os.path.join(rootdir, pname))
+    max_inflight = workers * PARALLEL_WALK_INFLIGHT_PER_WORKER
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            walk_iter = _parallel_walk_ordered(executor, srcdir, mindepth, maxdepth, list_function, walk_filter, max_inflight)
+        else:
+            walk_iter = _parallel_walk_unordered(executor, srcdir, mindepth, maxdepth, list_function, walk_filter, max_inflight)
+        for x in walk_iter:
+            yield x
+
+def _parallel_walk_unordered(executor, srcdir, mindepth, maxdepth, list_function, walk_filter, max_inflight):
+    stack = [(srcdir, 1)]
+    pending = {}
+    while stack or pending:
+        while stack and len(pending) < max_inflight:
+            rootdir, depth = stack.pop()
+            pending[executor.submit(_list_dir, rootdir, list_function, False, walk_filter)] = (rootdir, depth)
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            rootdir, depth = pending.pop(future)
+            dnames, fnames = future.result()
+            if mindepth <= depth:
+                yield rootdir, dnames, fnames
+            if depth < maxdepth:
+                stack.extend((os.path.join(rootdir, dname), depth+1) for dname in reversed(dnames))
+
+def _parallel_walk_ordered(executor, srcdir, mindepth, maxdepth, list_function, walk_filter, max_inflight):
+    # Depth-first stack of [rootdir, depth, future]. Before waiting on the top directory,
+    # listings are started for the directories that will be visited next.
+    stack = [[srcdir, 1, None]]
+    while stack:
+        for item in stack[:-max_inflight-1:-1]:
+            if item[2] is None:
+                item[2] = executor.submit(_list_dir, item[0], list_function, False, walk_filter)
+        rootdir, depth, future = stack.pop()
+        dnames, fnames = future.result()
+        if mindepth <= depth:
+            yield rootdir, dnames, fnames
+        if depth < maxdepth:
+            stack.extend([os.path.join(rootdir, dname), depth+1, None] for dname in reversed(dnames))
+
+def _check_walk_args(srcdir, mindepth, maxdepth):
+    if not os.path.isdir(srcdir):
+        raise InvalidArgumentError("`srcdir` directory does not exist: {}".format(srcdir))
+    if mindepth < 0 or maxdepth < 0:
+        raise InvalidArgumentError("depth arguments must be >= 0")
+    return os.path.abspath(srcdir)
+
+def _list_dir(rootdir, list_function, entries, walk_filter=None):
+    # Returns (dirs, files) as entries (`os.DirEntry`, or `WalkEntry` with `os.listdir`) or names.
+    dirs, files = [], []
+    listdir = (list_function is os.listdir)
+    for item in list_function(rootdir):
+        if not listdir:
+            dirent, name = item, item.name
+            is_dir = dirent.is_dir()
+        elif entries:
+            dirent, name = WalkEntry(rootdir, item), item
+            is_dir = dirent.is_dir()
+        else:
+            dirent, name = None, item
+            is_dir = os.path.isdir(os.path.join(rootdir, name))
+        if walk_filter is not None and not (
+                walk_filter.include_dir(rootdir, name) if is_dir else walk_filter.include_file(rootdir, name)):
+            continue
+        (dirs if is_dir else files).append(dirent if entries else name)
+    return dirs, files
+
+def _walk(srcdir, mindepth, maxdepth, list_function, entries, walk_filter, snapshot=None):
+    # Explicit stack of (rootdir, depth), so tree depth is not limited by recursion depth.
+    # Subdirectories are pushed in reverse so they are popped in listing order.
+    stack = [(srcdir, 1)]
+    while stack:
+        rootdir, depth = stack.pop()
+        if depth > maxdepth:
+            continue
+        if snapshot is not None:
+            dirs, files = snapshot.listdir(rootdir, list_function)
+            if walk_filter is not None:
+                dirs = [dname for dname in dirs if walk_filter.include_dir(rootdir, dname)]
+                files = [fname for fname in files if walk_filter.include_file(rootdir, fname)]
         else:
-            pname = dirent.name
-            dirent_is_dir = dirent.is_dir()
-        (dnames if dirent_is_dir else fnames).append(pname)
-    if mindepth <= depth <= maxdepth:
-        yield rootdir, dnames, fnames
-    if depth < maxdepth:
-        for dname in dnames:
-            for x in _walk(os.path.join(rootdir, dname), depth+1, mindepth, maxdepth, list_function):
-                yield x
+            dirs, files = _list_dir(rootdir, list_function, entries, walk_filter)
+        if mindepth <= depth:
+            yield rootdir, dirs, files
+        if depth < maxdepth:
+            if entries:
+                stack.extend((dirent.path, depth+1) for dirent in reversed(dirs))
+            else:
+                stack.extend((os.path.join(rootdir, dname), depth+1) for dname in reversed(dirs))
+
+class TreeDiffEntry(object):
+    # One difference between a source and destination tree.
+    # `src_entry`/`dst_entry` are the `os.DirEntry` (or `WalkEntry`) objects on either side, or None.
+    __slots__ = ('status', 'relpath', 'is_dir', 'src_entry', 'dst_entry')
+
+    def __init__(self, status, relpath, is_dir, src_entry, dst_entry):
+        self.status = status
+        self.relpath = relpath
+        self.is_dir = is_dir
+        self.src_entry = src_entry
+        self.dst_entry = dst_entry
+
+    def __repr__(self):
+        return '<TreeDiffEntry {} {!r}{}>'.format(self.status, self.relpath, '/' if self.is_dir else '')
+
+def diff_trees(srcdir, dstdir, list_function=WALK_LIST_FUNCTION_DEFAULT, walk_filter=None):
+    # Walks `srcdir` and `dstdir` together, merging the sorted listings of each pair of
+    # corresponding directories, and yields a `TreeDiffEntry` for every entry that is
+    # added (only in src), removed (only in dst) or changed (a file in both whose size differs,
+    # or whose src mtime is newer). Everything below an added or removed directory is
+    # also yielded as added or removed. The entries of each directory are yielded in name
+    # order, followed by those of its subdirectories, depth-first in name order.
+    # An entry that is a file on one side and a directory on the other is yielded as
+    # removed, then added. A missing `dstdir` is treated as empty.
+    # `walk_filter` name filters apply to both trees.
+    srcdir = _check_walk_args(srcdir, 0, 0)
+    dstdir = os.path.abspath(dstdir)
+    # Stack of (relative directory path, whether it exists in src, whether it exists in dst).
+    stack = [('', True, os.path.isdir(dstdir))]
+    while stack:
+        reldir, in_src, in_dst = stack.pop()
+        src_listing = _sorted_listing(os.path.join(srcdir, reldir), list_function, walk_filter) if in_src else []
+        dst_listing = _sorted_listing(os.path.join(dstdir, reldir), list_function, walk_filter) if in_dst else []
+        subdirs = []
+        i, j = 0, 0
+        while i < len(src_listing) or j < len(dst_listing):
+            src_name = src_listing[i][0] if i < len(src_listing) else None
+            dst_name = dst_listing[j][0] if j < len(dst_listing) else None
+            if dst_name is None or (src_name is not None and src_name < dst_name):
+                name, src_item, dst_item = src_name, src_listing[i], None
+                i += 1
+            elif src_name is None or dst_name < src_name:
+                name, src_item, dst_item = dst_name, None, dst_listing[j]
+                j += 1
+            else:
+                name, src_item, dst_item = src_name, src_listing[i], dst_listing[j]
+                i += 1
+                j += 1
+            relpath = os.path.join(reldir, name)
+
+            if src_item is not None and dst_item is not None and src_item[1] == dst_item[1]:
+                if src_item[1]:
+                    subdirs.append((relpath, True, True))
+                elif _file_changed(src_item[2], dst_item[2]):
+                    yield TreeDiffEntry(TREE_DIFF_CHANGED, relpath, False, src_item[2], dst_item[2])
+                continue
+            if dst_item is not None:
+                yield TreeDiffEntry(TREE_DIFF_REMOVED, relpath, dst_item[1], None, dst_item[2])
+                if dst_item[1]:
+                    subdirs.append((relpath, False, True))
+            if src_item is not None:
+                yield TreeDiffEntry(TREE_DIFF_ADDED, relpath, src_item[1], src_item[2], None)
+                if src_item[1]:
+                    subdirs.append((relpath, True, False))
+
+        stack.extend(reversed(subdirs))
+
+def _sorted_listing(rootdir, list_function, walk_filter):
+    # Returns a list of (name, is_dir, entry) sorted by name.
+    dirs, files = _list_dir(rootdir, list_function, True, walk_filter)
+    listing = [(dirent.name, True, dirent) for dirent in dirs]
+    listing.extend((dirent.name, False, dirent) for dirent in files)
+    listing.sort(key=lambda item: item[0])
+    return listing
+
+def _file_changed(src_entry, dst_entry):
+    src_stat = _entry_stat(src_entry)
+    dst_stat = _entry_stat(dst_entry)
+    if src_stat is None or dst_stat is None:
+        return True
+    return src_stat.st_size != dst_stat.st_size or src_stat.st_mtime > dst_stat.st_mtime
+
+def _entry_stat(entry):
+    # A broken symlink cannot be followed, so the link itself is compared instead.
+    # Returns None if the entry cannot be stat'ed at all (e.g. it was removed).
+    try:
+        return entry.stat()
+    except OSError:
+        try:
+            return entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+
+class _OutputFile(object):
+    # Textfile written to a temporary file, which only replaces `path` (or is copied to standard
+    # output if `path` is '-') on `commit`, so that a failed run never leaves partial output.
+
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.tmp_path = None
+            self.fp = tempfile.TemporaryFile('w+')
+        else:
+            self.tmp_path = "{}.partial-{}".format(path, os.getpid())
+            self.fp = open(self.tmp_path, 'w')
+
+    def write(self, line):
+        self.fp.write(line)
+
+    def commit(self):
+        if self.tmp_path is None:
+            self.fp.seek(0)
+            shutil.copyfileobj(self.fp, sys.stdout)
+            self.fp.close()
+            return
+        self.fp.close()
+        if hasattr(os, 'replace'):
+            os.replace(self.tmp_path, self.path)
+        else:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self.tmp_path, self.path)
+
+    def discard(self):
+        self.fp.close()
+        if self.tmp_path is not None and os.path.isfile(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def _check_output_path(path, delim=None):
+    if '\n' in path or (delim is not None and delim in path):
+        raise InvalidArgumentError("Path contains {}: {!r}".format(
+            "a newline" if '\n' in path else "the srclist delimiter '{}'".format(delim), path))
+
+def _is_below(relpath, dir_relpaths):
+    parent = os.path.dirname(relpath)
+    while parent != '':
+        if parent in dir_relpaths:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        "Compare a source and destination directory tree and write the source files that are "
+        "missing from or out of date in the destination as a 'src_path,dst_path' textfile, "
+        "for use with the --srclist option of file_transfer.py "
+        "(with --overwrite, so that out of date destination files are replaced). "
+        "A directory that is missing from the destination is written as a single "
+        "'src_dir/,dst_dir/' line, so that it is copied as a whole tree (including empty directories). "
+        "Paths that are a file in one tree and a directory in the other are left out of the srclist "
+        "and reported, since the destination must be removed before the source can be copied."))
+    parser.add_argument('srcdir',
+        help="Source directory tree.")
+    parser.add_argument('dstdir',
+        help="Destination directory tree.")
+    parser.add_argument('--srclist-out', default='-',
+        help="Path of srclist textfile to write, or '-' for standard output. (default='-')")
+    parser.add_argument('--srclist-delim', default=',',
+        help="Delimiter between source and destination paths, matching the --srclist-delim "
+             "option of file_transfer.py. (default=',')")
+    parser.add_argument('--added-only', action='store_true',
+        help="Leave files that exist in both trees but differ out of the srclist.")
+    parser.add_argument('--removed-out', default=None,
+        help="Also write the destination paths of entries that are missing from the source tree "
+             "to this textfile, one per line.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.srcdir):
+        parser.error("`srcdir` directory does not exist: {}".format(args.srcdir))
+    srcdir = os.path.abspath(args.srcdir)
+    dstdir = os.path.abspath(args.dstdir)
+
+    counts = {TREE_DIFF_ADDED: 0, TREE_DIFF_CHANGED: 0, TREE_DIFF_REMOVED: 0}
+    num_conflicts = 0
+    srclist_out = _OutputFile(args.srclist_out)
+    removed_out = _OutputFile(args.removed_out) if args.removed_out is not None else None
+    try:
+        removed_relpath = None
+        # Added directories, which are written (or skipped) as a whole along with everything below them
+        added_dir_relpaths = set()
+        for diff_entry in diff_trees(srcdir, dstdir):
+            counts[diff_entry.status] += 1
+            relpath = diff_entry.relpath
+            src_path = os.path.join(srcdir, relpath)
+            dst_path = os.path.join(dstdir, relpath)
+            if diff_entry.status == TREE_DIFF_REMOVED:
+                removed_relpath = relpath
+                if removed_out is not None:
+                    _check_output_path(dst_path)
+                    removed_out.write(dst_path + '\n')
+                continue
+            if added_dir_relpaths and _is_below(relpath, added_dir_relpaths):
+                continue
+            if diff_entry.is_dir:
+                added_dir_relpaths.add(relpath)
+            if relpath == removed_relpath:
+                # Yielded as removed, then added: a file in one tree and a directory in the other
+                num_conflicts += 1
+                sys.stderr.write("Source {} is a {} in the destination, skipping: {}\n".format(
+                    "directory" if diff_entry.is_dir else "file",
+                    "file" if diff_entry.is_dir else "directory", src_path))
+                continue
+            if args.added_only and diff_entry.status == TREE_DIFF_CHANGED:
+                continue
+            if diff_entry.is_dir:
+                src_path, dst_path = src_path + os.sep, dst_path + os.sep
+            _check_output_path(src_path, args.srclist_delim)
+            _check_output_path(dst_path, args.srclist_delim)
+            srclist_out.write(src_path + args.srclist_delim + dst_path + '\n')
+    except BaseException as e:
+        srclist_out.discard()
+        if removed_out is not None:
+            removed_out.discard()
+        if isinstance(e, InvalidArgumentError):
+            parser.error("{} (no output was written)".format(e))
+        raise
+    srclist_out.commit()
+    if removed_out is not None:
+        removed_out.commit()
+
+    sys.stderr.write("{} added, {} changed, {} removed, {} skipped as file/directory conflicts\n".format(
+        counts[TREE_DIFF_ADDED], counts[TREE_DIFF_CHANGED], counts[TREE_DIFF_REMOVED], num_conflicts))
+
+if __name__ == '__main__':
+    main()